@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 import onmt
 import torch.nn.functional as F
+from collections import OrderedDict
 
 
 from ae.VariationalLayer import VariationalLayer
@@ -12,9 +13,27 @@ class Autoencoder(nn.Module):
         super(Autoencoder, self).__init__()
 
         self.param_init = opt.param_init
-        
-        self.nmt = nmt_model
+        self.amp = getattr(opt, 'auto_encoder_amp', False)
+
+        # CUDA graphs of the frozen encoder + decoder pass, keyed by the input shapes
+        self.cuda_graph = getattr(opt, 'auto_encoder_cuda_graph', False)
+        self.cuda_graph_cache_size = 16
+        self._graph_cache = OrderedDict()
+
+        # keep the (frozen) NMT model out of the registered submodules, so that it does not
+        # show up in parameters() and state_dict() of the autoencoder
+        object.__setattr__(self, '_nmt_ref', [nmt_model])
+        # the generator used for the Probabilities representation, resolved once (also unregistered)
+        generator = nmt_model.generator
+        if isinstance(generator, nn.ModuleList):
+            generator = generator[0]
+        object.__setattr__(self, '_generator', generator)
         self.representation = opt.representation
+
+        # device side constants for the target masks, moved together with the module
+        self.register_buffer('_pad', torch.tensor(onmt.constants.PAD, dtype=torch.long), persistent=False)
+        self.register_buffer('_eos', torch.tensor(onmt.constants.EOS, dtype=torch.long), persistent=False)
+
         if(opt.auto_encoder_type is None):
             self.model_type = "Baseline"
         else:
@@ -26,10 +45,7 @@ class Autoencoder(nn.Module):
         elif (opt.representation == "EncoderDecoderHiddenState"):
             self.inputSize = nmt_model.encoder.model_size
         elif (opt.representation == "Probabilities"):
-            if(type(nmt_model.generator) is nn.ModuleList):
-                self.inputSize = nmt_model.generator[0].output_size
-            else:
-                self.inputSize = nmt_model.generator.output_size
+            self.inputSize = self._generator.output_size
         else:
             raise NotImplementedError("Waring!"+opt.represenation+" not implemented for auto encoder")
 
@@ -43,7 +59,18 @@ class Autoencoder(nn.Module):
             layers.append(nn.Dropout(opt.auto_encoder_drop_out))
         if(self.model_type == "Baseline"):
             layers.append(nn.Linear(self.inputSize, self.hiddenSize))
-            layers.append(nn.Sigmoid())
+            # models trained before the activation was configurable used sigmoid
+            activation = getattr(opt, 'auto_encoder_activation', 'sigmoid')
+            if(activation == "sigmoid"):
+                layers.append(nn.Sigmoid())
+            elif(activation == "hardsigmoid"):
+                layers.append(nn.Hardsigmoid())
+            elif(activation == "relu"):
+                layers.append(nn.ReLU(inplace=True))
+            elif(activation == "gelu"):
+                layers.append(nn.GELU(approximate='tanh'))
+            else:
+                raise NotImplementedError("Waring!" + activation + " not implemented for auto encoder")
         elif(self.model_type == "Variational"):
             self.variational_layer = VariationalLayer(self.inputSize,self.hiddenSize)
             layers.append(self.variational_layer)
@@ -58,46 +85,126 @@ class Autoencoder(nn.Module):
 
         self.model = nn.Sequential(*layers)
 
-        self.layers = layers
+        # Linear -> activation -> Linear is fully scriptable, which lets the JIT fuse the pointwise ops
+        if(self.model_type == "Baseline"):
+            self.model = torch.jit.script(self.model)
+
+        # the representation does not change, so pick the feature extractor only once
+        self._extract_fn = {"EncoderHiddenState": self._extract_enc,
+                            "DecoderHiddenState": self._extract_dec,
+                            "Probabilities": self._extract_probs}.get(self.representation)
+
         print("Autoencoder:",self.model)
 
-    def forward(self,batch):
+    def extract(self, batch):
+        """
+        Run the frozen NMT model and collect the representation used by the autoencoder
+        :param batch: the minibatch
+        :return: clean_output (autoencoder target), clean_context (autoencoder input),
+                 both with the padded positions removed
+        """
+        if self._extract_fn is None:
+            raise NotImplementedError("Waring!"+self.representation+" cannot be extracted for auto encoder")
 
-        src = batch.get('source')
-        tgt = batch.get('target_input')
+        with torch.no_grad():
+            clean_context = self._extract_fn(batch)
 
-        src = src.transpose(0, 1)  # transpose to have batch first
-        tgt = tgt.transpose(0, 1)
+        return clean_context, clean_context
 
+    def _extract_enc(self, batch):
 
-        if(self.representation == "EncoderHiddenState"):
-            with torch.no_grad():
-                encoder_output = self.nmt.encoder(src)
-                context = encoder_output['context']
-                src_mask = encoder_output['src_mask']
+        src = batch.get('source').transpose(0, 1)  # transpose to have batch first
 
-                flattened_context = context.contiguous().view(-1, context.size(-1))
-                flattened_mask = src_mask.squeeze(1).transpose(0,1).contiguous().view(-1)
-                non_pad_indices = torch.nonzero(1-flattened_mask).squeeze(1)
-                clean_context = flattened_context.index_select(0, non_pad_indices)
-                clean_output = clean_context
-        elif(self.representation == "DecoderHiddenState"):
-            with torch.no_grad():
+        encoder_output = self.nmt.encoder(src)
+        context = encoder_output['context']
+        src_mask = encoder_output['src_mask']
 
-                encoder_output = self.nmt.encoder(src)
-                context = encoder_output['context']
+        flattened_context = context.reshape(-1, context.size(-1))
+        # only the (small) mask is transposed to the time first layout of the context
+        flattened_mask = src_mask.squeeze(1).t().reshape(-1)
+        return flattened_context[flattened_mask.eq(0)]
 
-                decoder_output = self.nmt.decoder(tgt, context, src)
-                output = decoder_output['hidden']
+    def _extract_dec(self, batch):
+
+        src = batch.get('source').transpose(0, 1)  # transpose to have batch first
+        tgt_input = batch.get('target_input')
+
+        output = self._decoder_hidden(src, tgt_input.transpose(0, 1))
+
+        # target_input is time first, the same layout as the decoder output
+        flattened_mask = (tgt_input.eq(self._pad) | tgt_input.eq(self._eos)).view(-1)
+        flattened_output = output.reshape(-1, output.size(-1))
+        return flattened_output[flattened_mask.eq(0)]
+
+    def _run_nmt(self, src, tgt):
+
+        encoder_output = self.nmt.encoder(src)
+        context = encoder_output['context']
+
+        decoder_output = self.nmt.decoder(tgt, context, src)
+        return decoder_output['hidden']
+
+    def _decoder_hidden(self, src, tgt):
+        """
+        Decoder hidden states for batch first src/tgt. With cuda_graph the encoder + decoder pass
+        is captured once per input shape and replayed afterwards
+        """
+        if not self.cuda_graph or not src.is_cuda:
+            return self._run_nmt(src, tgt)
+
+        key = (tuple(src.shape), tuple(tgt.shape))
+
+        if key in self._graph_cache:
+            graph, static_src, static_tgt, static_output = self._graph_cache[key]
+            self._graph_cache.move_to_end(key)
+        else:
+            static_src, static_tgt = src.clone(), tgt.clone()
+            try:
+                # warm up on a side stream before capturing
+                stream = torch.cuda.Stream()
+                stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(stream):
+                    self._run_nmt(static_src, static_tgt)
+                torch.cuda.current_stream().wait_stream(stream)
+
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph):
+                    static_output = self._run_nmt(static_src, static_tgt)
+            except RuntimeError as e:
+                print("| WARNING: cannot capture the NMT model in a CUDA graph (%s), running it eagerly" % e)
+                self.cuda_graph = False
+                self._graph_cache.clear()
+                return self._run_nmt(src, tgt)
+
+            self._graph_cache[key] = (graph, static_src, static_tgt, static_output)
+            if len(self._graph_cache) > self.cuda_graph_cache_size:
+                self._graph_cache.popitem(last=False)
+
+        static_src.copy_(src)
+        static_tgt.copy_(tgt)
+        graph.replay()
+
+        return static_output
+
+    def _extract_probs(self, batch):
+
+        return self._generator(self._extract_dec(batch))
+
+    def forward(self, batch, cached=None):
+        """
+        :param batch: the minibatch
+        :param cached: (clean_output, clean_context) pair previously returned by extract().
+                       When given, the NMT model is not run at all.
+        """
 
-                tgt_mask = tgt.data.eq(onmt.constants.PAD).unsqueeze(1)
-                tgt_mask2 = tgt.data.eq(onmt.constants.EOS).unsqueeze(1)
-                tgt_mask = tgt_mask + tgt_mask2
-                flattened_output = output.contiguous().view(-1, output.size(-1))
-                flattened_mask = tgt_mask.squeeze(1).transpose(0,1).contiguous().view(-1)
-                non_pad_indices = torch.nonzero(1-flattened_mask).squeeze(1)
-                clean_context = flattened_output.index_select(0, non_pad_indices)
-                clean_output = clean_context
+        src = batch.get('source')
+        tgt = batch.get('target_input')
+
+        src = src.transpose(0, 1)  # transpose to have batch first
+        tgt = tgt.transpose(0, 1)
+
+        if cached is not None:
+            clean_output, clean_context = cached
         elif (self.representation == "EncoderDecoderHiddenState"):
             with torch.no_grad():
                 encoder_output = self.nmt.encoder(src)
@@ -122,45 +229,13 @@ class Autoencoder(nn.Module):
                 ##non_pad_indices = torch.nonzero(1-flattened_mask).squeeze(1)
                 #clean_context = flattened_context.index_select(0, non_pad_indices)
                 #clean_output = output.contiguous().view(-1, output.size(-1)).index_select(0,non_pad_indices)
-                clean_context = context.contiguous().view(-1, context.size(-1)).clone()
-
-        elif(self.representation == "Probabilities"):
-            with torch.no_grad():
-
-                encoder_output = self.nmt.encoder(src)
-                context = encoder_output['context']
-
-                decoder_output = self.nmt.decoder(tgt, context, src)
-                output = decoder_output['hidden']
-
-
-                tgt_mask = tgt.data.eq(onmt.constants.PAD).unsqueeze(1)
-                tgt_mask2 = tgt.data.eq(onmt.constants.EOS).unsqueeze(1)
-                tgt_mask = tgt_mask + tgt_mask2
-                flattened_output = output.contiguous().view(-1, output.size(-1))
-                flattened_mask = tgt_mask.squeeze(1).transpose(0,1).contiguous().view(-1)
-                non_pad_indices = torch.nonzero(1-flattened_mask).squeeze(1)
-                clean_context = flattened_output.index_select(0, non_pad_indices)
-                if (type(self.nmt.generator) is nn.ModuleList):
-                    clean_context = self.nmt.generator[0](clean_context)
-                else:
-                    clean_context = self.nmt.generator(clean_context)
-                clean_output = clean_context
-
+                clean_context = context.reshape(-1, context.size(-1)).clone()
 
         else:
-            raise NotImplementedError("Waring!"+opt.represenation+" not implemented for auto encoder")
-        
-        # clean_context.require_grad=False
-        clean_context.detach_()
-        clean_output.detach_()
-        
-        #result = self.model(clean_context)
-
-        result = clean_context
+            clean_output, clean_context = self.extract(batch)
 
-        for i in range(len(self.layers)):
-            result = self.layers[i](result)
+        # the features are computed under no_grad (or come from the cache) so they carry no graph
+        result = self._run_model(clean_context)
 
         if (self.representation == "Probabilities"):
             result = F.log_softmax(result, dim=-1)
@@ -173,9 +248,9 @@ class Autoencoder(nn.Module):
             cos = nn.CosineSimilarity(dim=-1, eps=1e-6)
             sim = cos(expand_result,clean_output)
 
-            tgt_mask = tgt.data.eq(onmt.constants.PAD).unsqueeze(1)
-            tgt_mask2 = tgt.data.eq(onmt.constants.EOS).unsqueeze(1)
-            tgt_mask = (tgt_mask + tgt_mask2).squeeze(1).transpose(0,1).unsqueeze(0).expand(result.size(0),-1,-1)
+            tgt_mask = tgt.eq(self._pad).unsqueeze(1)
+            tgt_mask2 = tgt.eq(self._eos).unsqueeze(1)
+            tgt_mask = (tgt_mask | tgt_mask2).squeeze(1).transpose(0,1).unsqueeze(0).expand(result.size(0),-1,-1)
             src_mask_align = src_mask.transpose(0,2).expand(-1,tgt_mask.size(1),-1)
             mask = torch.max(src_mask_align,tgt_mask)
 
@@ -184,12 +259,12 @@ class Autoencoder(nn.Module):
 
             clean_output = (alignment.unsqueeze(-1).expand(-1,-1,-1,result.size(-1)) * clean_output).sum(1)
 
-            flattened_result = result.contiguous().view(-1, result.size(-1))
-            flattened_output = clean_output.contiguous().view(-1, clean_output.size(-1))
-            flattened_mask = src_mask.squeeze(1).transpose(0,1).contiguous().view(-1)
-            non_pad_indices = torch.nonzero(1-flattened_mask).squeeze(1)
-            result = flattened_result.index_select(0, non_pad_indices)
-            clean_output = flattened_output.index_select(0, non_pad_indices)
+            flattened_result = result.reshape(-1, result.size(-1))
+            flattened_output = clean_output.reshape(-1, clean_output.size(-1))
+            flattened_mask = src_mask.squeeze(1).t().reshape(-1)
+            keep = flattened_mask.eq(0)
+            result = flattened_result[keep]
+            clean_output = flattened_output[keep]
         return clean_output,result
 
     def calcAlignment(self, batch):
@@ -207,21 +282,12 @@ class Autoencoder(nn.Module):
                 decoder_output = self.nmt.decoder(tgt, context, src)
                 output = decoder_output['hidden']
 
-                flat_context = context.contiguous().view(-1, context.size(-1))
+                flat_context = context.reshape(-1, context.size(-1))
 
         else:
             raise NotImplementedError("Waring!" + opt.represenation + " not implemented for auto encoder")
 
-        # clean_context.require_grad=False
-        flat_context = flat_context.detach()
-        output = output.detach()
-
-        # result = self.model(clean_context)
-
-        result = flat_context
-
-        for i in range(len(self.layers)):
-            result = self.layers[i](result)
+        result = self._run_model(flat_context)
 
         if (self.representation == "Probabilities"):
             result = F.log_softmax(result, dim=-1)
@@ -230,50 +296,38 @@ class Autoencoder(nn.Module):
 
     def autocode(self,input):
 
-        result = input.view(-1,input.size(2))
-        for i in range(len(self.layers)):
-            result = self.layers[i](result)
-        return result.view(input.size())
+        return self._run_model(input.view(-1, input.size(2))).view(input.size())
+
+    def _run_model(self, input):
+        """
+        Apply the autoencoder layers. With amp the layers run in bfloat16 while the NMT features
+        and the output (e.g. for the log_softmax over the vocabulary) keep their own precision
+        """
+        if not self.amp:
+            return self.model(input)
+
+        with torch.cuda.amp.autocast(dtype=torch.bfloat16):
+            result = self.model(input)
+
+        return result.type_as(input)
 
 
     def init_model_parameters(self):
-        for p in self.parameters():
-            p.data.uniform_(-self.param_init, self.param_init)
+        with torch.no_grad():
+            for p in self.parameters():
+                p.uniform_(-self.param_init, self.param_init)
             
 
-    def parameters(self):
-        param = []
-        for (n,p) in self.named_parameters():
-            if('nmt' not in n):
-                param.append(p)
-        return param
-        
+    @property
+    def nmt(self):
+        return self._nmt_ref[0]
 
     def load_state_dict(self, state_dict, strict=True):
-        
-        def condition(param_name):
-            
-            if 'positional_encoder' in param_name:
-                return False
-            if 'time_transformer' in param_name and self.nmt.encoder.time == 'positional_encoding':
-                return False
-            if param_name == 'nmt.decoder.mask':
-                return False
-#            if 'nmt' in param_name:
-#                return False
-            
-            return True
-        
-        if("nmt.generator.linear.weight" in state_dict and type(self.nmt.generator) is nn.ModuleList):
-            self.nmt.generator = self.nmt.generator[0]
-
-        filtered = {k: v for k, v in state_dict.items() if condition(k)}
-        
-        model_dict = self.state_dict()
-        for k,v in model_dict.items():
-            if k not in filtered:
-                filtered[k] = v
-        super().load_state_dict(filtered)   
-
-        if(type(self.nmt.generator) is not nn.ModuleList):
-            self.nmt.generator = nn.ModuleList([self.nmt.generator])
+
+        # checkpoints written before the NMT model was detached from the autoencoder also contain it
+        nmt_state_dict = {k[len('nmt.'):]: v for k, v in state_dict.items() if k.startswith('nmt.')}
+        if len(nmt_state_dict) > 0:
+            self.nmt.load_state_dict(nmt_state_dict)
+            state_dict = {k: v for k, v in state_dict.items() if not k.startswith('nmt.')}
+
+        super().load_state_dict(state_dict, strict=strict)
@@ -0,0 +1,74 @@
+import os
+import torch
+
+
+class AutoencoderFeatureCache(object):
+    """
+    Stores the (frozen) NMT features extracted by the autoencoder, keyed by batch index.
+    The NMT is never updated during autoencoder training, so after the first epoch
+    the encoder/decoder forward pass can be replaced by a lookup.
+
+    :param location: 'memory' keeps the features in (CPU) RAM, any other value is
+                     used as a directory in which every batch is saved as a separate file
+    """
+
+    def __init__(self, location='memory'):
+
+        self.in_memory = (location == 'memory')
+        self.directory = None if self.in_memory else location
+        self.features = dict()
+
+        if self.directory is not None and not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, index):
+        return os.path.join(self.directory, 'batch_%d.pt' % index)
+
+    def __contains__(self, index):
+        return index in self.features
+
+    def __len__(self):
+        return len(self.features)
+
+    def put(self, index, clean_output, clean_context):
+        """
+        :param index: the index of the batch in the dataset
+        :param clean_output: target of the autoencoder (non-pad rows only)
+        :param clean_context: input of the autoencoder (non-pad rows only)
+        """
+        # most representations use the same tensor as input and target, store it once
+        clean_context = None if clean_context is clean_output else clean_context.detach().cpu()
+        clean_output = clean_output.detach().cpu()
+
+        if self.in_memory:
+            self.features[index] = (clean_output, clean_context)
+        else:
+            torch.save((clean_output, clean_context), self._path(index))
+            self.features[index] = None
+
+    def get(self, index, device=None):
+
+        if self.in_memory:
+            clean_output, clean_context = self.features[index]
+        else:
+            clean_output, clean_context = torch.load(self._path(index), map_location='cpu')
+
+        if device is not None:
+            clean_output = clean_output.to(device, non_blocking=True)
+            if clean_context is not None:
+                clean_context = clean_context.to(device, non_blocking=True)
+
+        if clean_context is None:
+            clean_context = clean_output
+
+        return clean_output, clean_context
+
+    def clear(self):
+
+        if not self.in_memory:
+            for index in self.features:
+                path = self._path(index)
+                if os.path.exists(path):
+                    os.remove(path)
+
+        self.features = dict()
@@ -15,6 +15,7 @@ import random
 import numpy as np
 from onmt.multiprocessing.multiprocessing_wrapper import MultiprocessingRunner
 from onmt.train_utils.trainer import BaseTrainer
+from ae.FeatureCache import AutoencoderFeatureCache
 
 
 
@@ -38,6 +39,12 @@ class AETrainer(BaseTrainer):
 
         self.optim.set_parameters(self.autoencoder.parameters())
 
+        # the NMT model is frozen, so its features can be reused after the first epoch
+        self.feature_cache = None
+        feature_cache = getattr(opt, 'auto_encoder_feature_cache', None)
+        if feature_cache and self.autoencoder.representation != "EncoderDecoderHiddenState":
+            self.feature_cache = AutoencoderFeatureCache(feature_cache)
+
     def save(self, epoch, valid_ppl, batchOrder=None, iteration=-1):
 
         opt = self.opt
@@ -105,6 +112,9 @@ class AETrainer(BaseTrainer):
 
         if opt.extra_shuffle and epoch > opt.curriculum:
             train_data.shuffle()
+            # the batches are rebuilt so the cached features are no longer valid
+            if self.feature_cache is not None:
+                self.feature_cache.clear()
 
         # Shuffle mini batch order.
 
@@ -130,6 +140,15 @@ class AETrainer(BaseTrainer):
 
             curriculum = (epoch < opt.curriculum)
 
+            # the index of the batch that next() is going to return
+            batch_index = None
+            if self.feature_cache is not None:
+                cur_index = train_data.cur_index % train_data.num_batches
+                if curriculum or train_data.batchOrder is None:
+                    batch_index = cur_index
+                else:
+                    batch_index = int(train_data.batchOrder[cur_index])
+
             batch = train_data.next(curriculum=curriculum)[0]
             if (self.cuda):
                 batch.cuda()
@@ -140,7 +159,14 @@ class AETrainer(BaseTrainer):
                 batch_size = batch.size
 
                 # print("Input size:",batch[0].size())
-                targets,outputs = self.autoencoder(batch)
+                cached = None
+                if batch_index is not None:
+                    if batch_index not in self.feature_cache:
+                        self.feature_cache.put(batch_index, *self.autoencoder.extract(batch))
+                    device = torch.device('cuda') if self.cuda else None
+                    cached = self.feature_cache.get(batch_index, device=device)
+
+                targets,outputs = self.autoencoder(batch, cached=cached)
 
                 loss_data= self.loss_function(outputs, targets.data)
                 if(self.auto_encoder_type == "Variational"):
@@ -27,10 +27,9 @@ class VariationalLayer(nn.Module):
         if(self.training):
             std = self.stdLL(input)
             std = self.stdAct(std)
-            random = torch.randn(std.size())
-            if(std.is_cuda):
-                random = random.cuda()
+            # draw the noise directly on the device of std and fuse the reparameterisation
+            random = torch.randn_like(std)
             self.std = std
-            mean = mean + random * std
+            mean = torch.addcmul(mean, random, std)
         return mean
 
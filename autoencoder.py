@@ -32,6 +32,15 @@ parser.add_argument('-auto_encoder_drop_out', type=float, default=0,
                     help="Use drop_out in autoencoder")
 parser.add_argument('-auto_encoder_type', type=str, default="Baseline",
                     help="Use drop_out in autoencoder")
+parser.add_argument('-auto_encoder_activation', type=str, default="relu",
+                    help="Bottleneck activation of the Baseline autoencoder: relu|gelu|sigmoid|hardsigmoid")
+parser.add_argument('-auto_encoder_amp', action='store_true',
+                    help="Run the autoencoder layers in bfloat16 with autocast")
+parser.add_argument('-auto_encoder_cuda_graph', action='store_true',
+                    help="Replay the frozen encoder/decoder pass from CUDA graphs captured per batch shape")
+parser.add_argument('-auto_encoder_feature_cache', type=str, default=None,
+                    help="Cache the features of the frozen NMT model after the first epoch. "
+                         "Use 'memory' to keep them in RAM or give a directory to store them on disk")
 
 opt = parser.parse_args()
 
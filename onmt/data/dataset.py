@@ -194,7 +194,9 @@ class Batch(object):
                 if isinstance(tensor, torch.Tensor):
                     if tensor.type() == "torch.FloatTensor" and fp16:
                         self.tensors[key] = tensor.half()
-                    self.tensors[key] = self.tensors[key].cuda(device=device)
+                    # copies from pinned memory (-pin_memory) are queued asynchronously on the current stream
+                    tensor = self.tensors[key]
+                    self.tensors[key] = tensor.cuda(device=device, non_blocking=tensor.is_pinned())
             else:
                 continue
 
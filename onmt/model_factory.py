@@ -484,22 +484,24 @@ def init_model_parameters(model, opt):
         elif classname.find('PositionWiseFeedForward') != -1:
             m.reset_parameters(init=opt.init)
 
-    if opt.model != "pretrain_transformer":
-        print('Initializing entire model parameters')
-        model.apply(weights_init)
-    else:
-        if opt.enc_pretrained_model and not opt.dec_pretrained_model:
-            print('Initializing only decoder parameters')
-            model.decoder.apply(weights_init)
-        if not opt.enc_pretrained_model and opt.dec_pretrained_model:
-            print('Initializing only encoder parameters')
-            model.encoder.apply(weights_init)
-
-    if hasattr(model, 'decoder'):
-        if not opt.dec_pretrained_model:
-            model.decoder.word_lut.apply(weights_init)
-    else:
-        model.tgt_embedding.apply(weights_init)
+    with torch.no_grad():
+        if opt.model != "pretrain_transformer":
+            print('Initializing entire model parameters')
+            model.apply(weights_init)
+        else:
+            if opt.enc_pretrained_model and not opt.dec_pretrained_model:
+                print('Initializing only decoder parameters')
+                model.decoder.apply(weights_init)
+            if not opt.enc_pretrained_model and opt.dec_pretrained_model:
+                print('Initializing only encoder parameters')
+                model.encoder.apply(weights_init)
+
+            # the target embeddings were already initialized above when the whole model is initialized
+            if hasattr(model, 'decoder'):
+                if not opt.dec_pretrained_model:
+                    model.decoder.word_lut.apply(weights_init)
+            else:
+                model.tgt_embedding.apply(weights_init)
 
     if opt.multilingual_partitioned_weights:
         factor_embeddings = model.encoder.factor_embeddings
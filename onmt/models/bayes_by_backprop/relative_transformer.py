@@ -17,9 +17,6 @@ from onmt.models.bayes_by_backprop.relative_transformer_layers import \
     TransformerEncoderLayer, TransformerDecoderLayer
 
 
-torch.set_printoptions(threshold=500000)
-
-
 #  Positional Embedding with discrete inputs
 class SinusoidalPositionalEmbedding(nn.Module):
     def __init__(self, demb):
@@ -20,15 +20,6 @@ import math
 import sys
 from torch.utils.checkpoint import checkpoint
 
-torch.set_printoptions(threshold=500000)
-
-
-def create_forward_function(module):
-    def forward_pass(*inputs):
-        return module(*inputs)
-
-    return forward_pass
-
 
 class RelativeTransformerEncoder(TransformerEncoder):
 
@@ -45,6 +36,7 @@ class RelativeTransformerEncoder(TransformerEncoder):
         self.learnable_position_encoding = opt.learnable_position_encoding
         self.max_pos_length = opt.max_pos_length
         self.reversible = opt.src_reversible
+        self.reversible_offload = getattr(opt, 'reversible_offload', False)
 
         # build_modules will be called from the inherited constructor
         super(RelativeTransformerEncoder, self).__init__(opt, dicts, positional_encoder, encoder_type,
@@ -160,14 +152,15 @@ class RelativeTransformerEncoder(TransformerEncoder):
         context = self.preprocess_layer(emb)
 
         if self.reversible:
-            context = reversible_encoder(self.layer_modules, context, pos_emb, mask_src)
+            context = reversible_encoder(self.layer_modules, context, pos_emb, mask_src,
+                                         offload=self.reversible_offload and self.training)
         else:
             for i, layer in enumerate(self.layer_modules):
                 # src_len x batch_size x d_model
                 if self.checkpointing == 0 or self.training is False:
                     context = layer(context, pos_emb, mask_src, src_lang=input_lang)
                 else:
-                    context = checkpoint(create_forward_function(layer), context, pos_emb, mask_src, input_lang)
+                    context = checkpoint(layer, context, pos_emb, mask_src, input_lang, use_reentrant=False)
 
         # final layer norm. we can consider this layer norm as a part of the output layer/function
         context = self.postprocess_layer(context)
@@ -189,6 +182,7 @@ class RelativeTransformerDecoder(TransformerDecoder):
         self.learnable_position_encoding = opt.learnable_position_encoding
         self.max_pos_length = opt.max_pos_length
         self.reversible = opt.tgt_reversible
+        self.reversible_offload = getattr(opt, 'reversible_offload', False)
 
         # build_modules will be called from the inherited constructor
         super(RelativeTransformerDecoder, self).__init__(opt, dicts,
@@ -324,7 +318,8 @@ class RelativeTransformerDecoder(TransformerDecoder):
             # TODO: add src lang and tgt lang to reversible
             output, coverage = reversible_decoder(self.layer_modules, output, pos_emb, context,
                                                   dec_attn_mask.squeeze(-1), mask_src,
-                                                  False, None)  # incremental variables
+                                                  False, None,  # incremental variables
+                                                  offload=self.reversible_offload and self.training)
         else:
             for i, layer in enumerate(self.layer_modules):
 
@@ -334,9 +329,8 @@ class RelativeTransformerDecoder(TransformerDecoder):
                                                 src_lang=src_lang, tgt_lang=tgt_lang)
 
                 else:
-                    output, coverage, _ = checkpoint(create_forward_function(layer), output, context, pos_emb,
-                                                     dec_attn_mask,
-                                                     mask_src, src_lang, tgt_lang)
+                    output, coverage, _ = checkpoint(layer, output, context, pos_emb, dec_attn_mask,
+                                                     mask_src, src_lang, tgt_lang, use_reentrant=False)
 
         # From Google T2T
         # if normalization is done in layer_preprocess, then it should also be done
@@ -454,9 +448,9 @@ class RelativeTransformerDecoder(TransformerDecoder):
         if self.reversible:
             incremental = True
             incremental_cache = buffer
-            output, coverage = reversible_decoder.apply(self.layer_modules, output, pos_emb, context,
-                                                        dec_attn_mask, mask_src,
-                                                        incremental, incremental_cache)
+            output, coverage = reversible_decoder(self.layer_modules, output, pos_emb, context,
+                                                  dec_attn_mask, mask_src,
+                                                  incremental, incremental_cache, return_coverage=True)
         else:
             for i, layer in enumerate(self.layer_modules):
                 buffer = buffers[i] if i in buffers else None
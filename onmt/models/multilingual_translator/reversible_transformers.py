@@ -1,17 +1,46 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from contextlib import contextmanager
 from onmt.models.transformer_layers import PrePostProcessing
 from onmt.modules.attention import MultiHeadAttention
 from onmt.modules.optimized.relative_self_attention import RelativeSelfMultiheadAttn
 from onmt.modules.optimized.encdec_attention import EncdecMultiheadAttn
 from onmt.modules.optimized.feed_forward import PositionWiseFeedForward
 from onmt.modules.layer_norm import LayerNorm
-from torch.autograd.function import Function
-from torch.utils.checkpoint import get_device_states, set_device_states
+from torch.autograd.function import Function, once_differentiable
 from onmt.modules.dropout import variational_dropout
 
 
+def residual_dropout_function(p, variational=False):
+    """
+    Resolve the residual dropout of a sub-layer once, when the module is built.
+    :return: F.dropout or variational_dropout, None when p is 0 (no dropout at all)
+    """
+    if p <= 0:
+        return None
+
+    return variational_dropout if variational else F.dropout
+
+
+def dropout_residual(x, residual, p, training, dropout_fn=F.dropout):
+    """
+    Residual dropout of a sub-layer output, optionally followed by the residual connection.
+    The residual is added in-place into the (freshly allocated) dropout output to avoid
+    a second activation-sized buffer. The dropout itself stays the eager op so that the
+    recomputation in backward_pass (called without residual) reproduces the same mask.
+    """
+    o = x if dropout_fn is None else dropout_fn(x, p=p, training=training, inplace=False)
+
+    if residual is None:
+        return o
+
+    if o is x:  # dropout was a no-op, don't overwrite the sub-layer output
+        return o + residual
+
+    return o.add_(residual)
+
+
 class RelativeSelfAttention(nn.Module):
 
     def __init__(self, opt):
@@ -23,18 +52,20 @@ class RelativeSelfAttention(nn.Module):
                                               learnable_pos=opt.learnable_position_encoding,
                                               max_pos=opt.max_pos_length)
         self.variational = opt.variational_dropout
+        self.dropout_fn = residual_dropout_function(self.residual_dropout, self.variational)
 
     def forward(self, input, pos, key_padding_mask=None, attn_mask=None, incremental=False,
-                incremental_cache=None, cleaning=False):
+                incremental_cache=None, cleaning=False, residual=None):
         q = self.layer_norm(input)
+
         attn, coverage = self.attn(q, pos, key_padding_mask=key_padding_mask,
                                    attn_mask=attn_mask,
                                    incremental=incremental, incremental_cache=incremental_cache)
 
-        if not self.variational:
-            o = F.dropout(attn, p=self.residual_dropout, training=self.training, inplace=False)
-        else:
-            o = variational_dropout(attn, p=self.residual_dropout, inplace=False, training=self.training)
+        # keep the residual streams contiguous, otherwise every add/sub on them silently copies
+        attn = attn.contiguous()
+
+        o = dropout_residual(attn, residual, self.residual_dropout, self.training, self.dropout_fn)
 
         if cleaning:
             del q, attn
@@ -45,23 +76,39 @@ class FeedForward(nn.Module):
 
     def __init__(self, opt):
         super().__init__()
-        self.layer_norm = nn.LayerNorm((opt.model_size,), elementwise_affine=True)
+        self.layer_norm = LayerNorm((opt.model_size,), elementwise_affine=True)
         self.residual_dropout = opt.residual_dropout if opt.residual_dropout >= 0 else opt.dropout
         self.ffn_dropout = opt.ffn_dropout if opt.ffn_dropout >= 0 else opt.dropout
         self.feedforward = PositionWiseFeedForward(opt.model_size, opt.inner_size, self.ffn_dropout,
                                                    variational=opt.variational_dropout, glu=opt.ffn_glu,
                                                    activation=opt.ffn_activation)
         self.variational = opt.variational_dropout
+        self.dropout_fn = residual_dropout_function(self.residual_dropout, self.variational)
+
+        # without the CUDA fused mlp extension, -fused_ffn compiles the layer norm and the feed-forward instead.
+        # The dropouts stay eager outside of the compiled region: backward_pass recomputes this sub-layer
+        # from the replayed generator state and needs exactly the same masks as the no-grad forward,
+        # which two differently compiled graphs (with and without grad) do not guarantee
+        self.compile = opt.fused_ffn and not self.feedforward.fused and hasattr(torch, 'compile')
+        self.compiled_forward = None
+
+    def _forward(self, input):
 
-    def forward(self, input, cleaning=False):
+        return self.feedforward(self.layer_norm(input))
 
-        x_norm = self.layer_norm(input)
-        x_ff = self.feedforward(x_norm)
+    def forward(self, input, cleaning=False, residual=None):
 
-        if not self.variational:
-            o = F.dropout(x_ff, p=self.residual_dropout, training=self.training, inplace=False)
+        # the inner dropout of the feed-forward would be compiled too, so only compile when it is inactive
+        if self.compile and (self.ffn_dropout <= 0 or not self.training):
+            if self.compiled_forward is None:
+                self.compiled_forward = torch.compile(self._forward, dynamic=True)
+            x_norm = None
+            x_ff = self.compiled_forward(input)
         else:
-            o = variational_dropout(x_ff, p=self.residual_dropout, inplace=False, training=self.training)
+            x_norm = self.layer_norm(input)
+            x_ff = self.feedforward(x_norm)
+
+        o = dropout_residual(x_ff, residual, self.residual_dropout, self.training, self.dropout_fn)
 
         if cleaning:
             del x_norm, x_ff
@@ -73,30 +120,159 @@ class SourceAttention(nn.Module):
 
     def __init__(self, opt):
         super().__init__()
-        self.layer_norm = nn.LayerNorm((opt.model_size,), elementwise_affine=True)
+        self.layer_norm = LayerNorm((opt.model_size,), elementwise_affine=True)
         self.residual_dropout = opt.residual_dropout if opt.residual_dropout >= 0 else opt.dropout
         self.attn = EncdecMultiheadAttn(opt.n_heads, opt.model_size, attn_drop=opt.attn_dropout)
         self.dropout = opt.attn_dropout
         self.variational = opt.variational_dropout
+        self.dropout_fn = residual_dropout_function(self.residual_dropout, self.variational)
+        self.sdpa = getattr(opt, 'sdpa_src_attention', False) and hasattr(F, 'scaled_dot_product_attention')
+        # the fused attention kernels cast their inputs to float16 under autocast (custom_fwd),
+        # so bfloat16 is only honoured by the SDPA path
+        self.attn_bf16 = getattr(opt, 'attn_bf16', False) and self.sdpa
 
-    def forward(self, input, context, attn_mask=None, incremental=False, incremental_cache=None, cleaning=False):
+    def scaled_dot_product_attention(self, q, context, attn_mask=None):
+        """
+        Source attention through F.scaled_dot_product_attention, which dispatches to the
+        flash / memory efficient kernels and never materializes the attention matrix.
+        The attention weights are not returned (coverage is None).
+
+        :param q: len_q x bsz x model_size (already normalized)
+        :param context: len_k x bsz x model_size
+        :param attn_mask: bsz x 1 x len_k or bsz x len_k, True at the padded positions
+        """
+        attn = self.attn
+        len_q, bsz, len_k = q.size(0), q.size(1), context.size(0)
+        heads, head_dim = attn.num_heads, attn.head_dim
+
+        # same weight layout as the fused encdec_attn_func: kv is interleaved per head
+        queries = F.linear(q, attn.in_proj_weight_q).view(len_q, bsz, heads, head_dim).permute(1, 2, 0, 3)
+        kv = F.linear(context, attn.in_proj_weight_kv).view(len_k, bsz, heads, 2, head_dim)
+        keys = kv[:, :, :, 0, :].permute(1, 2, 0, 3)
+        values = kv[:, :, :, 1, :].permute(1, 2, 0, 3)
+
+        mask = None
+        if attn_mask is not None:
+            mask = attn_mask.to(torch.bool)
+            mask = mask.unsqueeze(1) if mask.dim() == 3 else mask.unsqueeze(1).unsqueeze(2)
+            # SDPA keeps the positions where the mask is True
+            mask = mask.logical_not()
+
+        output = F.scaled_dot_product_attention(queries, keys, values, attn_mask=mask,
+                                                dropout_p=attn.dropout if self.training else 0.0)
+        output = output.permute(2, 0, 1, 3).reshape(len_q, bsz, attn.embed_dim)
+
+        return F.linear(output, attn.out_proj_weight)
+
+    def forward(self, input, context, attn_mask=None, incremental=False, incremental_cache=None, cleaning=False,
+                residual=None):
         q = self.layer_norm(input)
-        attn, coverage = self.attn(q, context, context, attn_mask, incremental, incremental_cache)
 
-        if not self.variational:
-            o = F.dropout(attn, p=self.residual_dropout, training=self.training, inplace=False)
+        # the attention weights are only needed for decoding (incremental), which keeps the old path
+        if self.sdpa and not incremental and not self.attn.autograd:
+            # only the attention runs in bfloat16, the layer norm and the residual stream keep their precision
+            with torch.cuda.amp.autocast(enabled=self.attn_bf16 and q.is_cuda, dtype=torch.bfloat16):
+                attn, coverage = self.scaled_dot_product_attention(q, context, attn_mask), None
+            if self.attn_bf16:
+                attn = attn.type_as(input)
         else:
-            o = variational_dropout(attn, p=self.residual_dropout, inplace=False, training=self.training)
+            attn, coverage = self.attn(q, context, context, attn_mask, incremental, incremental_cache)
+
+        # keep the residual streams contiguous, otherwise every add/sub on them silently copies
+        attn = attn.contiguous()
+
+        o = dropout_residual(attn, residual, self.residual_dropout, self.training, self.dropout_fn)
 
         if cleaning:
             del q, attn
         return o, coverage
 
 
+def get_rng_state(*args):
+    """
+    Capture the state of the only generator the dropout of a sub-layer draws from:
+    the CUDA generator of the device of the inputs, or the CPU generator on CPU.
+    A CUDA generator state is just its seed and Philox offset.
+
+    :return: (device, state), device is None for the CPU generator
+    """
+    for arg in args:
+        if isinstance(arg, torch.Tensor) and arg.is_cuda:
+            device = arg.get_device()
+            return device, torch.cuda.default_generators[device].get_state()
+
+    return None, torch.get_rng_state()
+
+
+def set_rng_state(device, state):
+    if device is None:
+        torch.set_rng_state(state)
+    else:
+        torch.cuda.default_generators[device].set_state(state)
+
+
+@contextmanager
+def replay_rng_state(device, state):
+    """
+    Replay a state captured by get_rng_state and restore the current one afterwards.
+    Unlike torch.random.fork_rng only the captured generator is saved and restored.
+    """
+    current_state = torch.get_rng_state() if device is None else torch.cuda.default_generators[device].get_state()
+    set_rng_state(device, state)
+    try:
+        yield
+    finally:
+        set_rng_state(device, current_state)
+
+
+_offload_stream = None
+
+
+def offload_to_cpu(tensor):
+    """
+    Copy a (boundary) activation into pinned CPU memory on a side stream, so that its GPU memory
+    can be released between the forward and the backward pass.
+    :return: the CPU tensor and the event to wait on before using it
+    """
+    global _offload_stream
+    if _offload_stream is None:
+        _offload_stream = torch.cuda.Stream()
+
+    # the activation has to be computed before the copy starts
+    _offload_stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(_offload_stream):
+        cpu_tensor = torch.empty(tensor.size(), dtype=tensor.dtype, device='cpu', pin_memory=True)
+        cpu_tensor.copy_(tensor, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record(_offload_stream)
+
+    # don't let the caching allocator reuse the GPU memory before the copy is done
+    tensor.record_stream(_offload_stream)
+
+    return cpu_tensor, event
+
+
+def reload_from_cpu(cpu_tensor, event, device):
+    torch.cuda.current_stream(device).wait_event(event)
+    return cpu_tensor.to(device, non_blocking=True)
+
+
+def consume_backward(ctx):
+    """
+    The backward pass of the reversible functions restores the layer inputs in-place into the saved outputs,
+    so the saved tensors are only valid once: a second backward (retain_graph=True) must fail loudly
+    instead of silently reconstructing wrong activations.
+    """
+    if getattr(ctx, 'backward_done', False):
+        raise RuntimeError("The backward pass of the reversible layers can only run once "
+                           "(retain_graph is not supported): the saved activations are overwritten in-place.")
+    ctx.backward_done = True
+
+
 class ReversibleEncoderFunction(Function):
 
     @staticmethod
-    def forward(ctx, layers, hidden_states, pos, attn_mask):
+    def forward(ctx, layers, hidden_states, pos, attn_mask, offload=False):
 
         # attn_output, hidden_states = hidden_states, hidden_states # torch.chunk(hidden_states, 2, dim=-1)
         first_input, second_input = hidden_states, hidden_states
@@ -109,36 +285,51 @@ class ReversibleEncoderFunction(Function):
                     first_input, second_input, pos, attn_mask
                 )
 
+        with torch.no_grad():
+            output = torch.add(first_input, second_input).mul_(0.5)
+
         # attach params to ctx for backward
 
         # why should we detach here? because Y1 Y2 were built within torch.no_grad()
         # so cutting the backward from these variables seems unnecessary
+        # (no clone is needed: the output is computed out-of-place and nothing writes into Y1 Y2 afterwards)
 
         # save_for_backward will release memory more efficiently
-        ctx.save_for_backward(first_input.clone().detach(), second_input, pos)
+        ctx.offload = offload and first_input.is_cuda
+        if ctx.offload:
+            ctx.device = first_input.device
+            ctx.offloaded = [offload_to_cpu(first_input), offload_to_cpu(second_input)]
+            ctx.save_for_backward(pos)
+        else:
+            ctx.save_for_backward(first_input.detach(), second_input.detach(), pos)
         ctx.layers = layers
         ctx.attn_mask = attn_mask  # just in case attn_mask is None
 
-        with torch.no_grad():
-            output = first_input + second_input
-            output.div_(2)
-
         # The only memory footprint is the last layer outputs and the "output".
 
         return output
 
     @staticmethod
+    @once_differentiable
     def backward(ctx, grad_output):
 
-        grad_output.mul_(0.5)
-        first_grad_output, second_grad_output = grad_output, grad_output
+        consume_backward(ctx)
+
+        # out-of-place: grad_output belongs to the caller and must not be modified
+        half_grad_output = grad_output.mul(0.5)
+        first_grad_output, second_grad_output = half_grad_output, half_grad_output
 
         # retrieve params from ctx
-        first_output, second_output, pos = ctx.saved_tensors
+        if ctx.offload:
+            pos, = ctx.saved_tensors
+            first_output, second_output = [reload_from_cpu(*saved, ctx.device) for saved in ctx.offloaded]
+            del ctx.offloaded
+        else:
+            first_output, second_output, pos = ctx.saved_tensors
         layers = ctx.layers
         attn_mask = ctx.attn_mask
 
-        for idx, layer in enumerate(layers[::-1]):
+        for layer in reversed(layers):
             # backprop
             first_output, second_output, first_grad_output, second_grad_output = layer.backward_pass(
                 first_output, second_output, first_grad_output, second_grad_output, pos, attn_mask
@@ -147,11 +338,11 @@ class ReversibleEncoderFunction(Function):
         grad_hidden_states = first_grad_output + second_grad_output
 
         # the position encodings don't need embeddings
-        return None, grad_hidden_states, None, None
+        return None, grad_hidden_states, None, None, None
 
 
-def reversible_encoder(layers, hidden_states, pos, attn_mask):
-    return ReversibleEncoderFunction.apply(layers, hidden_states, pos, attn_mask)
+def reversible_encoder(layers, hidden_states, pos, attn_mask, offload=False):
+    return ReversibleEncoderFunction.apply(layers, hidden_states, pos, attn_mask, offload)
 
 
 class ReversibleTransformerEncoderLayer(nn.Module):
@@ -172,8 +363,7 @@ class ReversibleTransformerEncoderLayer(nn.Module):
             to recalculate activations.
         """
 
-        self.attn_cpu_state = torch.get_rng_state()
-        self.attn_gpu_devices, self.attn_gpu_states = get_device_states(*args)
+        self.attn_rng_device, self.attn_rng_state = get_rng_state(*args)
 
     def _init_feedforward_seed(self, *args):
         """
@@ -184,8 +374,7 @@ class ReversibleTransformerEncoderLayer(nn.Module):
                     to recalculate activations.
                 """
 
-        self.ffn_cpu_state = torch.get_rng_state()
-        self.ffn_gpu_devices, self.ffn_gpu_states = get_device_states(*args)
+        self.ffn_rng_device, self.ffn_rng_state = get_rng_state(*args)
 
     def forward(self, x1, x2, pos, attn_mask=None):
         """
@@ -201,16 +390,15 @@ class ReversibleTransformerEncoderLayer(nn.Module):
         # to have correct dropout
 
         self._init_attention_seed(x2, pos, attn_mask)
-        z1, coverage = self.self_attn(x2, pos, key_padding_mask=attn_mask, attn_mask=None, cleaning=True)
-
-        y1 = z1 + x1
+        # y1 = x1 + F(x2)
+        y1, coverage = self.self_attn(x2, pos, key_padding_mask=attn_mask, attn_mask=None, cleaning=True,
+                                      residual=x1)
 
         self._init_feedforward_seed(y1)
-        z2 = self.feedforward(y1, cleaning=True)
+        # y2 = x2 + G(y1)
+        y2 = self.feedforward(y1, cleaning=True, residual=x2)
 
-        y2 = z2 + x2
-
-        del x1, x2, z1, z2
+        del x1, x2
 
         """return Y1 and Y2"""
         return y1, y2
@@ -229,41 +417,38 @@ class ReversibleTransformerEncoderLayer(nn.Module):
 
         with torch.enable_grad():
             y1.requires_grad = True
-            with torch.random.fork_rng(devices=self.ffn_gpu_devices, enabled=True):
-                torch.set_rng_state(self.ffn_cpu_state)
-                set_device_states(self.ffn_gpu_devices, self.ffn_gpu_states)
-
+            with replay_rng_state(self.ffn_rng_device, self.ffn_rng_state):
                 gy1 = self.feedforward(y1)
 
             gy1.backward(dy2)
 
         with torch.no_grad():
             # restore X2 = Y2 - G(Y1)
-            x2 = y2 - gy1
+            # (the dead Y2 buffer and the fresh Y1.grad are reused in-place instead of allocating new tensors)
+            x2 = y2.sub_(gy1)
             del gy1, y2
 
-            dx1 = dy1 + y1.grad
-            del dy1
+            dx1 = y1.grad
             y1.grad = None
+            dx1.add_(dy1)
+            del dy1
 
         with torch.enable_grad():
             x2.requires_grad = True
 
-            with torch.random.fork_rng(devices=self.attn_gpu_devices, enabled=True):
-                torch.set_rng_state(self.attn_cpu_state)
-                set_device_states(self.attn_gpu_devices, self.attn_gpu_states)
-
+            with replay_rng_state(self.attn_rng_device, self.attn_rng_state):
                 fx2, _, = self.self_attn(x2, pos, key_padding_mask=attn_mask)
 
             fx2.backward(dx1)
 
         with torch.no_grad():
             # restore X1 = Y1 - F(X2)
-            x1 = y1 - fx2
+            x1 = y1.sub_(fx2)
             del y1, fx2
 
-            dx2 = dy2 + x2.grad
+            dx2 = x2.grad
             x2.grad = None
+            dx2.add_(dy2)
             del dy2
 
         return x1, x2, dx1, dx2
@@ -278,23 +463,23 @@ class ReversibleDecoderFunction(Function):
 
     @staticmethod
     def forward(ctx, layers, hidden_states, pos, context, tgt_mask, src_mask,
-                incremental=False, incremental_cache=None):
+                incremental=False, incremental_cache=None, return_coverage=False, offload=False):
 
-        bsz, seq_len = hidden_states.shape[0], hidden_states.shape[1]
-        B = bsz * seq_len
-        idx = 0
         x1, x2 = hidden_states, hidden_states
-        coverages = []
+        coverage, coverage_src = None, None
 
         for layer in layers:
-            idx = idx + 1
             # forward pass in the layer
             x1, x2, coverage_src = layer(
                 x1, x2, pos, context, tgt_mask, src_mask,
                 incremental=incremental, incremental_cache=incremental_cache
             )
 
-            coverages.append(coverage_src)
+        # like the non-reversible decoder, only the attention of the last layer is returned
+        # and it is only kept when asked for (e.g. for the alignments during decoding)
+        if return_coverage:
+            coverage = coverage_src
+            ctx.mark_non_differentiable(coverage)
 
         # attach params to ctx for backward
 
@@ -303,55 +488,70 @@ class ReversibleDecoderFunction(Function):
 
         # save_for_backward will release memory more efficiently
         # detach() seems to be required especially for context ...
-        ctx.save_for_backward(x1.clone().detach(), x2, context, pos)
+        ctx.offload = offload and x1.is_cuda
+        if ctx.offload:
+            # the context is also referenced outside of the decoder, offloading it wouldn't free anything
+            ctx.device = x1.device
+            ctx.offloaded = [offload_to_cpu(x1), offload_to_cpu(x2)]
+            ctx.save_for_backward(context, pos)
+        else:
+            ctx.save_for_backward(x1.detach(), x2.detach(), context, pos)
         ctx.layers = layers
         ctx.src_mask = src_mask
         ctx.tgt_mask = tgt_mask
 
         with torch.no_grad():
-            output = x1 + x2
+            output = torch.add(x1, x2).mul_(0.5)
 
-        # concatenate 2 revnet outputs:
-        return output.mul_(0.5), torch.stack(coverages)
+        # average the 2 revnet outputs:
+        return output, coverage
 
     @staticmethod
+    @once_differentiable
     def backward(ctx, grad_hidden_states, grad_coverage):
+
+        consume_backward(ctx)
+
         # We need three arguments because the forward pass returned 3 arguments
         # grad_attn_output, grad_hidden_states = torch.chunk(grad_hidden_states, 2, dim=-1)
-        grad_hidden_states.mul_(0.5)
-        dx1, dx2 = grad_hidden_states, grad_hidden_states
+        # out-of-place: grad_hidden_states belongs to the caller and must not be modified
+        half_grad_hidden_states = grad_hidden_states.mul(0.5)
+        dx1, dx2 = half_grad_hidden_states, half_grad_hidden_states
 
         # retrieve params from ctx
-        x1, x2, context, pos = ctx.saved_tensors
+        if ctx.offload:
+            context, pos = ctx.saved_tensors
+            x1, x2 = [reload_from_cpu(*saved, ctx.device) for saved in ctx.offloaded]
+            del ctx.offloaded
+        else:
+            x1, x2, context, pos = ctx.saved_tensors
         layers = ctx.layers
         src_mask = ctx.src_mask
         tgt_mask = ctx.tgt_mask
-        grad_context = None  # we need to sum up the gradients of the context manually
 
-        for idx, layer in enumerate(layers[::-1]):
+        """Note: the context is detached once and shared by all layers,
+        autograd accumulates the gradients of every layer into its .grad"""
+        context = context.detach().requires_grad_(True)
+
+        for layer in reversed(layers):
 
-            """Note: Here for each layer we detach the context once because we need to consider it
-            as a separate variable and then later accumulate the gradients"""
-            x1, x2, dx1, dx2, grad_context_ = layer.backward_pass(
+            x1, x2, dx1, dx2 = layer.backward_pass(
                 x1, x2, dx1, dx2,
-                pos, context.detach(), tgt_mask, src_mask
+                pos, context, tgt_mask, src_mask
             )
 
-            if grad_context is None:
-                grad_context = grad_context_
-            elif grad_context_ is not None:  # prevent ignoring layer making this None
-                grad_context.add_(grad_context_)
-                del grad_context_
-
+        grad_context = context.grad
         grad_input = dx1 + dx2
 
         # grad pos is also None
-        return None, grad_input, None, grad_context, None, None, None, None
+        return None, grad_input, None, grad_context, None, None, None, None, None, None
 
 
-def reversible_decoder(layers, hidden_states, pos, context, tgt_mask, src_mask, incremental, incremental_cache):
+def reversible_decoder(layers, hidden_states, pos, context, tgt_mask, src_mask, incremental, incremental_cache,
+                       return_coverage=False, offload=False):
     return ReversibleDecoderFunction.apply(layers, hidden_states, pos, context,
-                                           tgt_mask, src_mask, incremental, incremental_cache)
+                                           tgt_mask, src_mask, incremental, incremental_cache, return_coverage,
+                                           offload)
 
 
 class ReversibleTransformerDecoderLayer(nn.Module):
@@ -380,8 +580,7 @@ class ReversibleTransformerDecoderLayer(nn.Module):
             to recalculate activations.
         """
 
-        self.src_attn_cpu_state = torch.get_rng_state()
-        self.src_attn_gpu_devices, self.src_attn_gpu_states = get_device_states(*args)
+        self.src_attn_rng_device, self.src_attn_rng_state = get_rng_state(*args)
 
     def _init_attention_seed(self, *args):
         """
@@ -393,8 +592,7 @@ class ReversibleTransformerDecoderLayer(nn.Module):
         """
 
         # randomize seeds
-        self.attn_cpu_state = torch.get_rng_state()
-        self.attn_gpu_devices, self.attn_gpu_states = get_device_states(*args)
+        self.attn_rng_device, self.attn_rng_state = get_rng_state(*args)
 
     def _init_feedforward1_seed(self, *args):
         """
@@ -406,8 +604,7 @@ class ReversibleTransformerDecoderLayer(nn.Module):
                 """
 
         # randomize seeds
-        self.ffn1_cpu_state = torch.get_rng_state()
-        self.ffn1_gpu_devices, self.ffn1_gpu_states = get_device_states(*args)
+        self.ffn1_rng_device, self.ffn1_rng_state = get_rng_state(*args)
 
     def _init_feedforward2_seed(self, *args):
         """
@@ -419,8 +616,7 @@ class ReversibleTransformerDecoderLayer(nn.Module):
                 """
 
         # randomize seeds
-        self.ffn2_cpu_state = torch.get_rng_state()
-        self.ffn2_gpu_devices, self.ffn2_gpu_states = get_device_states(*args)
+        self.ffn2_rng_device, self.ffn2_rng_state = get_rng_state(*args)
 
     def forward(self, x1, x2, pos, context, mask_tgt, mask_src,
                 incremental=False, incremental_cache=None, reuse_source=True):
@@ -444,35 +640,34 @@ class ReversibleTransformerDecoderLayer(nn.Module):
         with torch.no_grad():
             # prepare the state for the first function (att > src->att)
             self._init_attention_seed(x2, pos)
-            f_x2, coverage, = self.self_attention(x2, pos,
-                                                  key_padding_mask=None, attn_mask=mask_tgt,
-                                                  incremental=incremental,
-                                                  incremental_cache=incremental_cache,
-                                                  cleaning=True)
+            # z1 = x1 + F(x2)
+            z1, coverage, = self.self_attention(x2, pos,
+                                                key_padding_mask=None, attn_mask=mask_tgt,
+                                                incremental=incremental,
+                                                incremental_cache=incremental_cache,
+                                                cleaning=True, residual=x1)
 
-            z1 = f_x2 + x1
+            assert z1.is_contiguous(), "the reversible residual stream should stay contiguous"
 
             self._init_feedforward1_seed(z1)
-            g_z1 = self.feed_forward_first(z1, cleaning=True)
-
-            z2 = x2 + g_z1
+            # z2 = x2 + G(z1)
+            z2 = self.feed_forward_first(z1, cleaning=True, residual=x2)
 
             self._init_src_attention_seed(z2, context, mask_src)
-            h_z2, coverage_src = self.src_attention(z2, context, mask_src,
-                                                    incremental=incremental,
-                                                    incremental_cache=incremental_cache)
-
-            y1 = z1 + h_z2
+            # y1 = z1 + H(z2)
+            y1, coverage_src = self.src_attention(z2, context, mask_src,
+                                                  incremental=incremental,
+                                                  incremental_cache=incremental_cache,
+                                                  residual=z1)
 
             # prepare the state for the second function
             self._init_feedforward2_seed(y1)
-            k_y1 = self.feed_forward_second(y1, cleaning=True)
+            # y2 = z2 + K(y1)
+            y2 = self.feed_forward_second(y1, cleaning=True, residual=z2)
 
             # if self.training and self.death_rate > 0:
             #     g_y1 = g_y1 / (1 - self.death_rate)
 
-            y2 = z2 + k_y1
-
         """return Y1 and Y2"""
         return y1, y2, coverage_src
 
@@ -485,7 +680,7 @@ class ReversibleTransformerDecoderLayer(nn.Module):
         :param y2
         :param dy1: dL/dX2
         :param dy2: dL/dY2
-        :param context:
+        :param context: requires grad, the gradient w.r.t the context is accumulated into context.grad
         :param mask_tgt:
         :param mask_src:
         :param incremental:
@@ -495,38 +690,33 @@ class ReversibleTransformerDecoderLayer(nn.Module):
         """
 
         # if not self.forward_coin:  # this layer was skipped, just return
-        #     return y1, y2, dy1, dy2, None
+        #     return y1, y2, dy1, dy2
 
         # first block: recompute the ffn transition function
         with torch.enable_grad():
             y1.requires_grad = True
 
-            with torch.random.fork_rng(devices=self.ffn2_gpu_devices, enabled=True):
-                torch.set_rng_state(self.ffn2_cpu_state)
-                set_device_states(self.ffn2_gpu_devices, self.ffn2_gpu_states)
-
+            with replay_rng_state(self.ffn2_rng_device, self.ffn2_rng_state):
                 k_y1 = self.feed_forward_second(y1)
 
             k_y1.backward(dy2)
 
         with torch.no_grad():
-            z2 = y2 - k_y1
+            # the dead Y2 buffer and the fresh Y1.grad are reused in-place instead of allocating new tensors
+            z2 = y2.sub_(k_y1)
             del k_y1, y2
 
             # Dz1 = DY1 + Y1.grad
-            dz1 = dy1 + y1.grad
-            del dy1
+            dz1 = y1.grad
             y1.grad = None
+            dz1.add_(dy1)
+            del dy1
 
         # second block
         with torch.enable_grad():
             z2.requires_grad = True
-            context.requires_grad = True
-
-            with torch.random.fork_rng(devices=self.src_attn_gpu_devices, enabled=True):
-                torch.set_rng_state(self.src_attn_cpu_state)
-                set_device_states(self.src_attn_gpu_devices, self.src_attn_gpu_states)
 
+            with replay_rng_state(self.src_attn_rng_device, self.src_attn_rng_state):
                 # if not self.ignore_source:
                 h_z2, _ = self.src_attention(z2, context, mask_src,
                                              incremental=incremental,
@@ -536,46 +726,38 @@ class ReversibleTransformerDecoderLayer(nn.Module):
             h_z2.backward(dz1)
 
         with torch.no_grad():
-            z1 = y1 - h_z2
+            z1 = y1.sub_(h_z2)
             del y1, h_z2
 
-            dz2 = dy2 + z2.grad
+            dz2 = z2.grad
             z2.grad = None
+            dz2.add_(dy2)
             del dy2
 
-            grad_context = context.grad
-            del context.grad
-
         # third block
         with torch.enable_grad():
             z1.requires_grad = True
 
-            with torch.random.fork_rng(devices=self.ffn1_gpu_devices, enabled=True):
-                torch.set_rng_state(self.ffn1_cpu_state)
-                set_device_states(self.ffn1_gpu_devices, self.ffn1_gpu_states)
-
+            with replay_rng_state(self.ffn1_rng_device, self.ffn1_rng_state):
                 g_z1 = self.feed_forward_first(z1)
 
             # torch.autograd.backward(g_z1, dz2)
             g_z1.backward(dz2)
         #
         with torch.no_grad():
-            x2 = z2 - g_z1
+            x2 = z2.sub_(g_z1)
             del z2, g_z1
 
-            dx1 = dz1 + z1.grad
-
+            dx1 = z1.grad
             z1.grad = None
+            dx1.add_(dz1)
             del dz1
 
         # fourth block
         with torch.enable_grad():
             x2.requires_grad = True
 
-            with torch.random.fork_rng(devices=self.attn_gpu_devices, enabled=True):
-                torch.set_rng_state(self.attn_cpu_state)
-                set_device_states(self.attn_gpu_devices, self.attn_gpu_states)
-
+            with replay_rng_state(self.attn_rng_device, self.attn_rng_state):
                 f_x2, _, = self.self_attention(x2, pos,
                                                key_padding_mask=None, attn_mask=mask_tgt,
                                                incremental=incremental,
@@ -584,12 +766,12 @@ class ReversibleTransformerDecoderLayer(nn.Module):
             f_x2.backward(dx1)
 
         with torch.no_grad():
-            x1 = z1 - f_x2
+            x1 = z1.sub_(f_x2)
             del z1, f_x2
 
-            dx2 = dz2 + x2.grad
+            dx2 = x2.grad
             x2.grad = None
-
+            dx2.add_(dz2)
             del dz2
 
-        return x1, x2, dx1, dx2, grad_context
+        return x1, x2, dx1, dx2
@@ -244,25 +244,24 @@ class PretrainTransformer(NMTModel):
                 self.autoencoder.representation == "DecoderHiddenState":
             output = self.autoencoder.autocode(output)
 
-        for dec_t, tgt_t in zip(output, tgt_output):
-
-            dec_out = defaultdict(lambda: None)
-            dec_out['hidden'] = dec_t.unsqueeze(0)
-            dec_out['src'] = src
-            dec_out['context'] = context
-
-            if isinstance(self.generator, nn.ModuleList):
-                gen_t = self.generator[0](dec_out)['logits']
-            else:
-                gen_t = self.generator(dec_out)['logits']
-            gen_t = F.log_softmax(gen_t, dim=-1, dtype=torch.float32)
-            gen_t = gen_t.squeeze(0)
-            tgt_t = tgt_t.unsqueeze(1)
-            scores = gen_t.gather(1, tgt_t)
-            scores.masked_fill_(tgt_t.eq(onmt.constants.TGT_PAD), 0)
-            gold_scores += scores.squeeze(1).type_as(gold_scores)
-            gold_words += tgt_t.ne(onmt.constants.TGT_PAD).sum().item()
-            allgold_scores.append(scores.squeeze(1).type_as(gold_scores))
+        # score all time steps at once: len_tgt x batch_size x vocab
+        dec_out = defaultdict(lambda: None)
+        dec_out['hidden'] = output
+        dec_out['src'] = src
+        dec_out['context'] = context
+
+        if isinstance(self.generator, nn.ModuleList):
+            gen = self.generator[0](dec_out)['logits']
+        else:
+            gen = self.generator(dec_out)['logits']
+        gen = F.log_softmax(gen, dim=-1, dtype=torch.float32)
+        # len_tgt x batch_size
+        scores = gen.gather(2, tgt_output.unsqueeze(2)).squeeze(2)
+        scores.masked_fill_(tgt_output.eq(onmt.constants.TGT_PAD), 0)
+        scores = scores.type_as(gold_scores)
+        gold_scores += scores.sum(0)
+        gold_words += tgt_output.ne(onmt.constants.TGT_PAD).sum().item()
+        allgold_scores = list(scores.unbind(0))
 
         return gold_words, gold_scores, allgold_scores
 
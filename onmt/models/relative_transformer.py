@@ -9,7 +9,8 @@ import onmt
 from onmt.modules.base_seq2seq import NMTModel, Reconstructor, DecoderState
 from onmt.modules.dropout import embedded_dropout
 from onmt.models.transformer_layers import XavierLinear, MultiHeadAttention, FeedForward, PrePostProcessing
-from onmt.models.relative_transformer_layers import RelativeTransformerEncoderLayer, RelativeTransformerDecoderLayer
+from onmt.models.relative_transformer_layers import RelativeTransformerEncoderLayer, RelativeTransformerDecoderLayer, \
+    LayerGraphCache
 from onmt.reversible_models.relative_transformers import ReversibleEncoderFunction, ReversibleDecoderFunction, \
     ReversibleTransformerDecoderLayer, ReversibleTransformerEncoderLayer
 from onmt.utils import flip, expected_length
@@ -17,8 +18,6 @@ from collections import defaultdict
 import math
 import sys
 
-torch.set_printoptions(threshold=500000)
-
 
 #  Positional Embedding with discrete inputs
 class SinusoidalPositionalEmbedding(nn.Module):
@@ -69,6 +68,11 @@ class RelativeTransformerEncoder(TransformerEncoder):
         super(RelativeTransformerEncoder, self).__init__(opt, dicts, positional_encoder, encoder_type,
                                                          language_embeddings)
 
+        self.cuda_graph_layers = getattr(opt, 'cuda_graph_layers', False)
+        self.layer_graphs = None
+        self.compile_layers = getattr(opt, 'compile_layers', False) and hasattr(torch, 'compile')
+        self.compiled_layers = None
+
         # learnable position encoding
         if self.learnable_position_encoding:
             raise NotImplementedError
@@ -101,6 +105,16 @@ class RelativeTransformerEncoder(TransformerEncoder):
 
             self.layer_modules.append(block)
 
+    def get_compiled_layers(self):
+        """
+        torch.compile'd wrappers of the layers, built on first use. They are kept in a plain list
+        (not registered as sub-modules) so the parameter names in the state dict are unchanged.
+        """
+        if self.compiled_layers is None:
+            self.compiled_layers = [torch.compile(layer, dynamic=True) for layer in self.layer_modules]
+
+        return self.compiled_layers
+
     def create_stream_mask(self, input, input_length, prev_mem_size):
 
         lengths = input_length.tolist()
@@ -269,11 +283,30 @@ class RelativeTransformerEncoder(TransformerEncoder):
             # print(context.size(), pos_emb.size())
             context = ReversibleEncoderFunction.apply(context, pos_emb, self.layer_modules, mask_src)
         else:
-            for i, layer in enumerate(self.layer_modules):
+            graphed_layers = None
+            if self.cuda_graph_layers and self.training and not streaming and context.is_cuda:
+                if self.layer_graphs is None:
+                    self.layer_graphs = LayerGraphCache(self.layer_modules)
+                graphed_layers = self.layer_graphs.get(context, pos_emb, mask_src)
+
+            # the stochastic depth coins of the whole stack, drawn at once from the (seeded) torch generator
+            coins = torch.rand(len(self.layer_modules)).tolist() if self.training else None
+
+            layers = self.layer_modules
+            if self.compile_layers and self.training and not streaming and graphed_layers is None:
+                layers = self.get_compiled_layers()
+
+            for i, layer in enumerate(layers):
                 # src_len x batch_size x d_model
+                coin = coins[i] >= self.layer_modules[i].death_rate if coins is not None else None
+
+                if graphed_layers is not None:
+                    if coin:
+                        context = graphed_layers[i](context, pos_emb, mask_src)
+                    continue
 
                 mems_i = mems[i] if mems is not None and streaming and self.max_memory_size > 0 else None
-                context = layer(context, pos_emb, mask_src, mems=mems_i)
+                context = layer(context, pos_emb, mask_src, mems=mems_i, coin=coin)
 
                 if streaming:
                     hids.append(context)
@@ -312,6 +345,10 @@ class RelativeTransformerDecoder(TransformerDecoder):
 
         self.positional_encoder = SinusoidalPositionalEmbedding(opt.model_size)
         self.d_head = self.model_size // self.n_heads
+        self.cuda_graph_layers = getattr(opt, 'cuda_graph_layers', False)
+        self.layer_graphs = None
+        self.compile_layers = getattr(opt, 'compile_layers', False) and hasattr(torch, 'compile')
+        self.compiled_layers = None
         # Parameters for the position biases - deprecated. kept for backward compatibility
         self.r_w_bias = nn.Parameter(torch.Tensor(self.n_heads, self.d_head))
         self.r_r_bias = nn.Parameter(torch.Tensor(self.n_heads, self.d_head))
@@ -341,6 +378,16 @@ class RelativeTransformerDecoder(TransformerDecoder):
 
             self.layer_modules.append(block)
 
+    def get_compiled_layers(self):
+        """
+        torch.compile'd wrappers of the layers, built on first use. They are kept in a plain list
+        (not registered as sub-modules) so the parameter names in the state dict are unchanged.
+        """
+        if self.compiled_layers is None:
+            self.compiled_layers = [torch.compile(layer, dynamic=True) for layer in self.layer_modules]
+
+        return self.compiled_layers
+
     def process_embedding(self, input, input_lang=None):
 
         return input
@@ -486,7 +533,8 @@ class RelativeTransformerDecoder(TransformerDecoder):
         """ Embedding: batch_size x len_tgt x d_model """
         input = input.transpose(0, 1)  # T x B
         emb = embedded_dropout(self.word_lut, input, dropout=self.word_dropout if self.training else 0)
-        emb = emb * math.sqrt(self.model_size)
+        # in-place: the embedding lookup does not save its output for backward
+        emb.mul_(math.sqrt(self.model_size))
 
         if streaming:
             src_lengths = kwargs.get("src_lengths", None)
@@ -572,14 +620,37 @@ class RelativeTransformerDecoder(TransformerDecoder):
                                                      dec_attn_mask, mask_src)
             coverage = None
         else:
+            graphed_layers = None
+            if self.cuda_graph_layers and self.training and not streaming and output.is_cuda \
+                    and context is not None:
+                if self.layer_graphs is None:
+                    self.layer_graphs = LayerGraphCache(self.layer_modules)
+                graphed_layers = self.layer_graphs.get(output, context, pos_emb, dec_attn_mask, mask_src)
+
+            # the stochastic depth coins of the whole stack, drawn at once from the (seeded) torch generator
+            coins = torch.rand(len(self.layer_modules)).tolist() if self.training else None
+
+            layers = self.layer_modules
+            if self.compile_layers and self.training and not streaming and graphed_layers is None:
+                layers = self.get_compiled_layers()
+
+            for i, layer in enumerate(layers):
+                coin = coins[i] >= self.layer_modules[i].death_rate if coins is not None else None
+
+                # the graphed layers only return the hidden states (no coverage)
+                if graphed_layers is not None:
+                    if coin:
+                        output = graphed_layers[i](output, context, pos_emb, dec_attn_mask, mask_src)
+                    coverage = None
+                    continue
 
-            for i, layer in enumerate(self.layer_modules):
                 # batch_size x src_len x d_model output, coverage = layer(output, context, pos_emb, self.r_w_bias,
                 # self.r_r_bias, dec_attn_mask, mask_src)
                 mems_i = mems[i] if mems is not None and streaming and \
                                     self.stream_context in ['local', 'global'] and self.max_memory_size > 0 else None
 
-                output, coverage, _ = layer(output, context, pos_emb, dec_attn_mask, mask_src, mems=mems_i)
+                output, coverage, _ = layer(output, context, pos_emb, dec_attn_mask, mask_src, mems=mems_i,
+                                            coin=coin)
                 if streaming:
                     hids.append(output)
 
@@ -637,8 +708,6 @@ class RelativeTransformerDecoder(TransformerDecoder):
                 decoder_state.input_seq = torch.cat([decoder_state.input_seq, input], 0)
             input = decoder_state.input_seq.transpose(0, 1)  # B x T
 
-        src = decoder_state.src.transpose(0, 1) if decoder_state.src is not None else None
-
         if buffering:
             # use the last value of input to continue decoding
             if input.size(1) > 1:
@@ -684,7 +753,10 @@ class RelativeTransformerDecoder(TransformerDecoder):
         else:
             dec_attn_mask = None
 
-        if context is not None:
+        # the source does not change between steps, so the mask is only built once per decoding state
+        mask_src = getattr(decoder_state, 'src_pad_mask', None)
+        if context is not None and mask_src is None:
+            src = decoder_state.src.transpose(0, 1)
             if self.encoder_type == "audio":
                 if not self.encoder_cnn_downsampling:
                     mask_src = src.narrow(2, 0, 1).squeeze(2).eq(onmt.constants.PAD).unsqueeze(1)
@@ -693,8 +765,7 @@ class RelativeTransformerDecoder(TransformerDecoder):
                     mask_src = long_mask[:, 0:context.size(0) * 4:4].unsqueeze(1)
             else:
                 mask_src = src.eq(onmt.constants.PAD).unsqueeze(1)
-        else:
-            mask_src = None
+            decoder_state.src_pad_mask = mask_src
 
         output = emb.contiguous()
 
@@ -1104,6 +1175,7 @@ class StreamDecodingState(DecoderState):
         self.beam_size = beam_size
         self.model_size = model_size
         self.src_mask = None
+        self.src_pad_mask = None
         # self.attention_buffers = dict()
         self.streaming_state = streaming_state
 
@@ -1148,6 +1220,8 @@ class StreamDecodingState(DecoderState):
 
         if self.src_mask is not None:
             self.src_mask = self.src_mask.index_select(0, reorder_state)
+        if self.src_pad_mask is not None:
+            self.src_pad_mask = self.src_pad_mask.index_select(0, reorder_state)
         self.src = self.src.index_select(1, reorder_state)
 
         for l in self.streaming_state.src_buffer:
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 import torch
 import torch.nn as nn
 import onmt
@@ -23,12 +24,15 @@ class RelativeTransformerEncoderLayer(nn.Module):
         super(RelativeTransformerEncoderLayer, self).__init__()
         self.variational = opt.variational_dropout
         self.death_rate = death_rate
+        # stochastic depth: scale of the residual branch when the layer is kept
+        self.inv_keep = 1.0 / (1.0 - death_rate) if death_rate < 1 else 1.0
         self.fast_self_attention = opt.fast_self_attention
+        norm_type = 'rmsnorm' if getattr(opt, 'rms_norm', False) else 'layernorm'
 
-        self.preprocess_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n')
+        self.preprocess_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n', norm_type=norm_type)
         self.postprocess_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='da',
                                                   variational=self.variational)
-        self.preprocess_ffn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n')
+        self.preprocess_ffn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n', norm_type=norm_type)
         self.postprocess_ffn = PrePostProcessing(opt.model_size, opt.dropout, sequence='da',
                                                  variational=self.variational)
         d_head = opt.model_size // opt.n_heads
@@ -38,7 +42,6 @@ class RelativeTransformerEncoderLayer(nn.Module):
         else:
             self.multihead = RelativeSelfMultiheadAttn(opt.model_size, opt.n_heads, opt.attn_dropout)
 
-        print (opt.fast_feed_forward)
         if not opt.fast_feed_forward:
             feedforward = FeedForward(opt.model_size, opt.inner_size, opt.dropout, variational=self.variational)
             self.feedforward = Bottle(feedforward)
@@ -46,16 +49,19 @@ class RelativeTransformerEncoderLayer(nn.Module):
             self.feedforward = PositionWiseFeedForward(opt.model_size, opt.inner_size, opt.dropout,
                                                        variational=self.variational)
 
-    def forward(self, input, pos_emb, attn_mask, incremental=False, incremental_cache=None, mems=None):
+    def forward(self, input, pos_emb, attn_mask, incremental=False, incremental_cache=None, mems=None, coin=None):
 
         if incremental and incremental_cache is None:
             incremental_cache = dict()
 
-        coin = True
-        if self.training and self.death_rate > 0:
-            coin = (torch.rand(1)[0].item() >= self.death_rate)
+        if coin is None:
+            coin = True
+            if self.training and self.death_rate > 0:
+                coin = (torch.rand(1)[0].item() >= self.death_rate)
 
         if coin:
+            # stochastic depth: scale of the residual branches, folded into the residual adds
+            scale = self.inv_keep if self.training else 1.0
 
             # memory for transformer-xl caching
             if mems is not None and mems.size(0) > 0:
@@ -71,22 +77,14 @@ class RelativeTransformerEncoderLayer(nn.Module):
                 out, _ = self.multihead(query, pos_emb, attn_mask, None, mems=mems,
                                         incremental=incremental, incremental_cache=incremental_cache)
 
-            # rescaling before residual
-            if self.training and self.death_rate > 0:
-                out = out / (1 - self.death_rate)
-
-            input = self.postprocess_attn(out, input)
+            input = self.postprocess_attn(out, input, scale=scale)
 
             """ Feed forward layer 
                 layernorm > ffn > dropout > residual
             """
             out = self.feedforward(self.preprocess_ffn(input))
 
-            # rescaling before residual
-            if self.training and self.death_rate > 0:
-                out = out / (1 - self.death_rate)
-
-            input = self.postprocess_ffn(out, input)
+            input = self.postprocess_ffn(out, input, scale=scale)
 
         if incremental:
             return input, incremental_cache
@@ -103,25 +101,29 @@ class RelativeTransformerDecoderLayer(nn.Module):
         self.ignore_source = opt.ignore_source
         self.variational = opt.variational_dropout
         self.death_rate = death_rate
+        # stochastic depth: scale of the residual branch when the layer is kept
+        self.inv_keep = 1.0 / (1.0 - death_rate) if death_rate < 1 else 1.0
         self.fast_self_attention = opt.fast_self_attention
         self.fast_xattention = opt.fast_xattention
         # self.lfv_multilingual = opt.lfv_multilingual
+        norm_type = 'rmsnorm' if getattr(opt, 'rms_norm', False) else 'layernorm'
 
-        self.preprocess_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n')
+        self.preprocess_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n', norm_type=norm_type)
         self.postprocess_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='da',
                                                   variational=self.variational)
 
         if not self.ignore_source:
-            self.preprocess_src_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n')
+            self.preprocess_src_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n', norm_type=norm_type)
             self.postprocess_src_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='da',
                                                           variational=self.variational)
 
             if opt.fast_xattention:
                 self.multihead_src = EncdecMultiheadAttn(opt.n_heads, opt.model_size, opt.attn_dropout)
             else:
-                self.multihead_src = MultiHeadAttention(opt.n_heads, opt.model_size, attn_p=opt.attn_dropout, share=2)
+                self.multihead_src = MultiHeadAttention(opt.n_heads, opt.model_size, attn_p=opt.attn_dropout, share=2,
+                                                        sdpa=getattr(opt, 'sdpa_attention', False))
 
-        self.preprocess_ffn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n')
+        self.preprocess_ffn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n', norm_type=norm_type)
         self.postprocess_ffn = PrePostProcessing(opt.model_size, opt.dropout, sequence='da',
                                                  variational=self.variational)
 
@@ -133,14 +135,14 @@ class RelativeTransformerDecoderLayer(nn.Module):
         else:
             self.multihead_tgt = RelativeSelfMultiheadAttn(opt.model_size, opt.n_heads, opt.attn_dropout)
 
-        # if not opt.fast_feed_forward:
-        #     feedforward = FeedForward(opt.model_size, opt.inner_size, opt.dropout, variational=self.variational)
-        #     self.feedforward = Bottle(feedforward)
-        # else:
-        #     self.feedforward = PositionWiseFeedForward(opt.model_size, opt.inner_size, opt.dropout,
-        #                                                variational=self.variational)
-        feedforward = FeedForward(opt.model_size, opt.inner_size, opt.dropout, variational=self.variational)
-        self.feedforward = Bottle(feedforward)
+        # the decoder kept the Bottle(FeedForward) parameters under -fast_feed_forward, so the fused
+        # feed-forward has its own option to keep older checkpoints loadable
+        if not getattr(opt, 'fast_feed_forward_decoder', False):
+            feedforward = FeedForward(opt.model_size, opt.inner_size, opt.dropout, variational=self.variational)
+            self.feedforward = Bottle(feedforward)
+        else:
+            self.feedforward = PositionWiseFeedForward(opt.model_size, opt.inner_size, opt.dropout,
+                                                       variational=self.variational)
 
         # if opt.lfv_multilingual:
         #     self.lid_net = lid_net
@@ -151,7 +153,7 @@ class RelativeTransformerDecoderLayer(nn.Module):
 
     # def forward(self, input, context, pos_emb, r_w_bias, r_r_bias, mask_tgt, mask_src):
     def forward(self, input, context, pos_emb, mask_tgt, mask_src,
-                incremental=False, incremental_cache=None, reuse_source=True, mems=None):
+                incremental=False, incremental_cache=None, reuse_source=True, mems=None, coin=None):
 
         """ Self attention layer
             layernorm > attn > dropout > residual
@@ -160,11 +162,15 @@ class RelativeTransformerDecoderLayer(nn.Module):
         if incremental and incremental_cache is None:
             incremental_cache = dict()
 
-        coin = True
-        if self.training and self.death_rate > 0:
-            coin = (torch.rand(1)[0].item() >= self.death_rate)
+        if coin is None:
+            coin = True
+            if self.training and self.death_rate > 0:
+                coin = (torch.rand(1)[0].item() >= self.death_rate)
 
         if coin:
+            # stochastic depth: scale of the residual branches, folded into the residual adds
+            scale = self.inv_keep if self.training else 1.0
+
             # input and context should be time first ?
             if mems is not None and mems.size(0) > 0:
                 mems = self.preprocess_attn(mems)
@@ -182,27 +188,20 @@ class RelativeTransformerDecoderLayer(nn.Module):
                                                                incremental=incremental,
                                                                incremental_cache=incremental_cache)
 
-            # rescaling before residual
-            if self.training and self.death_rate > 0:
-                out = out / (1 - self.death_rate)
-
-            input = self.postprocess_attn(out, input)
+            input = self.postprocess_attn(out, input, scale=scale)
 
             """ Context Attention layer 
                 layernorm > attn > dropout > residual
+                (skipped without a context, e.g. for decoder-only batches)
             """
-            if not self.ignore_source:
+            if not self.ignore_source and context is not None:
                 query = self.preprocess_src_attn(input)
                 incremental_source = incremental and reuse_source
                 out, coverage = self.multihead_src(query, context, context, mask_src,
                                                    incremental=incremental_source,
                                                    incremental_cache=incremental_cache)
 
-                # rescaling before residual
-                if self.training and self.death_rate > 0:
-                    out = out / (1 - self.death_rate)
-
-                input = self.postprocess_src_attn(out, input)
+                input = self.postprocess_src_attn(out, input, scale=scale)
             else:
                 coverage = None
 
@@ -211,12 +210,84 @@ class RelativeTransformerDecoderLayer(nn.Module):
             """
             out = self.feedforward(self.preprocess_ffn(input))
 
-            # rescaling before residual
-            if self.training and self.death_rate > 0:
-                out = out / (1 - self.death_rate)
-
-            input = self.postprocess_ffn(out, input)
+            input = self.postprocess_ffn(out, input, scale=scale)
         else:
             coverage = None
 
         return input, coverage, incremental_cache
+
+
+class _AliveLayer(nn.Module):
+    """
+    Runs a layer with the stochastic depth coin forced to True and returns only the hidden states,
+    which is the tensor-only callable torch.cuda.make_graphed_callables needs
+    """
+
+    def __init__(self, layer):
+        super(_AliveLayer, self).__init__()
+        self.layer = layer
+
+    def forward(self, *args):
+        output = self.layer(*args, coin=True)
+        return output[0] if isinstance(output, tuple) else output
+
+
+class LayerGraphCache(object):
+    """
+    CUDA graphs of a layer stack for training, one graph per layer and input shape (LRU).
+    The stochastic depth coin is drawn outside of the graphs: every layer is captured alive
+    and a dropped layer is simply not replayed.
+
+    :param layers: the nn.ModuleList of the encoder/decoder
+    :param cache_size: number of input shapes to keep graphs for
+    """
+
+    def __init__(self, layers, cache_size=4):
+
+        self.layers = layers
+        self.cache_size = cache_size
+        self.graphs = OrderedDict()
+        self.enabled = True
+
+    def get(self, *args):
+        """
+        :param args: the tensor arguments of the layer forward
+        :return: the graphed layers for these inputs or None if they cannot be captured
+        """
+        if not self.enabled:
+            return None
+
+        key = (tuple((tuple(arg.shape), arg.dtype, arg.requires_grad) for arg in args),
+               torch.is_autocast_enabled())
+
+        if key in self.graphs:
+            self.graphs.move_to_end(key)
+            return self.graphs[key]
+
+        # the graphs own their static inputs, the incoming tensors are copied into them at each replay.
+        # Every layer needs its own: the backward of a layer reads the activations saved in its static inputs,
+        # which a shared buffer would already hold the input of the next layer for.
+        # The hidden states (first argument) of every layer above the first come from the layer below,
+        # so they require grad even when the input of the stack doesn't (e.g. frozen embeddings)
+        per_layer_args = tuple(
+            tuple(arg.detach().clone().requires_grad_(arg.requires_grad or (i > 0 and j == 0))
+                  for j, arg in enumerate(args))
+            for i in range(len(self.layers)))
+
+        try:
+            # make_graphed_callables refuses to capture with the autocast weight cache enabled
+            with torch.cuda.amp.autocast(enabled=torch.is_autocast_enabled(), cache_enabled=False):
+                # captured in one call (in execution order) so that the graphs share one memory pool
+                graphed = list(torch.cuda.make_graphed_callables(tuple(_AliveLayer(layer) for layer in self.layers),
+                                                                 per_layer_args))
+        except RuntimeError as e:
+            print("| WARNING: cannot capture the layers in CUDA graphs (%s), running them eagerly" % e)
+            self.enabled = False
+            self.graphs.clear()
+            return None
+
+        self.graphs[key] = graphed
+        if len(self.graphs) > self.cache_size:
+            self.graphs.popitem(last=False)
+
+        return graphed
@@ -18,8 +18,6 @@ from onmt.modules.checkpoint import checkpoint
 # from torch.utils.checkpoint import checkpoint
 from onmt.modules.identity import Identity
 
-torch.set_printoptions(threshold=500000)
-
 
 def create_forward_function(module):
     def forward_pass(*inputs):
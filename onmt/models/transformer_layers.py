@@ -16,6 +16,7 @@ from onmt.modules.optimized.encdec_attention import EncdecMultiheadAttn
 from onmt.modules.optimized.self_attention import SelfMultiheadAttn
 from onmt.modules.optimized.feed_forward import PositionWiseFeedForward
 from collections import defaultdict
+from functools import lru_cache
 from onmt.modules.pre_post_processing import PrePostProcessing
 
 
@@ -245,7 +246,8 @@ class DecoderLayer(nn.Module):
         if opt.fast_self_attention:
             self.multihead_tgt = SelfMultiheadAttn(opt.model_size, opt.n_heads, opt.attn_dropout)
         else:
-            self.multihead_tgt = MultiHeadAttention(opt.n_heads, opt.model_size, attn_p=opt.attn_dropout, share=1)
+            self.multihead_tgt = MultiHeadAttention(opt.n_heads, opt.model_size, attn_p=opt.attn_dropout, share=1,
+                                                    sdpa=getattr(opt, 'sdpa_attention', False))
 
         if not self.ignore_source:
             self.preprocess_src_attn = PrePostProcessing(opt.model_size, opt.dropout, sequence='n')
@@ -253,7 +255,8 @@ class DecoderLayer(nn.Module):
                                                           variational=self.variational)
 
             if not opt.fast_xattention:
-                self.multihead_src = MultiHeadAttention(opt.n_heads, opt.model_size, attn_p=opt.attn_dropout, share=2)
+                self.multihead_src = MultiHeadAttention(opt.n_heads, opt.model_size, attn_p=opt.attn_dropout, share=2,
+                                                        sdpa=getattr(opt, 'sdpa_attention', False))
             else:
                 self.multihead_src = EncdecMultiheadAttn(opt.n_heads, opt.model_size, opt.attn_dropout)
 
@@ -351,6 +354,21 @@ class DecoderLayer(nn.Module):
         return input, coverage, incremental_cache
 
 
+@lru_cache(maxsize=8)
+def _sinusoidal_table(d_model, len_max):
+    """
+    The sinusoidal table only depends on (d_model, len_max), so it is computed once
+    and cached for every PositionalEncoding with the same sizes (which copy it)
+    """
+    position = torch.arange(0, len_max).float()
+
+    num_timescales = d_model // 2
+    log_timescale_increment = math.log(10000) / (num_timescales - 1)
+    inv_timescales = torch.exp(torch.arange(0, num_timescales).float() * -log_timescale_increment)
+    scaled_time = position.unsqueeze(1) * inv_timescales.unsqueeze(0)
+    return torch.cat((torch.sin(scaled_time), torch.cos(scaled_time)), 1)
+
+
 class PositionalEncoding(nn.Module):
     """Adds positional embeddings to standard word embeddings 
     This matches the original TensorFlow implementation at
@@ -389,13 +407,9 @@ class PositionalEncoding(nn.Module):
             # self.data_type = torch.type(self.pos_emb)
             del self.pos_emb
 
-        position = torch.arange(0, new_max_len).float()
-
-        num_timescales = self.d_model // 2
-        log_timescale_increment = math.log(10000) / (num_timescales - 1)
-        inv_timescales = torch.exp(torch.arange(0, num_timescales).float() * -log_timescale_increment)
-        scaled_time = position.unsqueeze(1) * inv_timescales.unsqueeze(0)
-        pos_emb = torch.cat((torch.sin(scaled_time), torch.cos(scaled_time)), 1)
+        # the buffer gets its own copy: load_state_dict copies into buffers in-place,
+        # which would otherwise overwrite the cached table shared by the other instances
+        pos_emb = _sinusoidal_table(self.d_model, new_max_len).clone()
 
         if cuda:
             pos_emb = pos_emb.cuda()
@@ -420,9 +434,9 @@ class PositionalEncoding(nn.Module):
             time_ = self.pos_emb[:len_seq, :].type_as(word_emb)
             out = word_emb + time_
         else:
-            time_emb = self.pos_emb[len_seq - 1, :]  # 1 x dim
-            # out should have size bs x 1 x dim
-            out = word_emb + time_emb.unsqueeze(0).repeat(word_emb.size(0), 1, 1).type_as(word_emb)
+            time_emb = self.pos_emb[len_seq - 1, :]  # dim
+            # out should have size bs x 1 x dim (the position is broadcast over the batch)
+            out = word_emb + time_emb.type_as(word_emb)
         return out
 
     def get_positional_embeddings(self, word_emb, t=None):
@@ -415,8 +415,6 @@ class TransformerDecoder(nn.Module):
                 decoder_state.input_seq = torch.cat([decoder_state.input_seq, input], 0)
             input = decoder_state.input_seq.transpose(0, 1)
 
-        src = decoder_state.src.transpose(0, 1) if decoder_state.src is not None else None
-
         if input.size(1) > 1:
             input_ = input[:, -1].unsqueeze(1)
         else:
@@ -450,7 +448,10 @@ class TransformerDecoder(nn.Module):
         emb = emb.transpose(0, 1)
 
         # batch_size x 1 x len_src
-        if context is not None:
+        # the source does not change between steps, so the mask is only built once per decoding state
+        mask_src = getattr(decoder_state, 'src_pad_mask', None)
+        if context is not None and mask_src is None:
+            src = decoder_state.src.transpose(0, 1)
             if self.encoder_type == "audio":
                 if src.dim() == 3:
                     if self.encoder_cnn_downsampling:
@@ -465,14 +466,12 @@ class TransformerDecoder(nn.Module):
                     mask_src = src.eq(onmt.constants.SRC_PAD).unsqueeze(1)
             else:
                 mask_src = src.eq(onmt.constants.SRC_PAD).unsqueeze(1)
-        else:
-            mask_src = None
+            decoder_state.src_pad_mask = mask_src
 
         len_tgt = input.size(1)
-        mask_tgt = torch.triu(
-            emb.new_ones(len_tgt, len_tgt), diagonal=1).byte().unsqueeze(0)
-        # only get the final step of the mask during decoding (because the input of the network is only the last step)
-        mask_tgt = mask_tgt[:, -1, :].unsqueeze(1)
+        # only the final step of the causal mask is needed during decoding (the input of the network is only
+        # the last step), and the last row of the mask is empty: build it directly instead of len_tgt x len_tgt
+        mask_tgt = emb.new_zeros(1, 1, len_tgt).byte()
 
         if torch_version >= 1.2:
             mask_tgt = mask_tgt.bool()
@@ -705,28 +704,27 @@ class Transformer(NMTModel):
                 self.autoencoder.representation == "DecoderHiddenState":
             output = self.autoencoder.autocode(output)
 
-        for dec_t, tgt_t in zip(output, tgt_output):
+        # score all time steps at once: len_tgt x batch_size x vocab
+        dec_out = defaultdict(lambda: None)
+        dec_out['hidden'] = output
+        dec_out['src'] = src
+        dec_out['context'] = context
 
-            dec_out = defaultdict(lambda: None)
-            dec_out['hidden'] = dec_t.unsqueeze(0)
-            dec_out['src'] = src
-            dec_out['context'] = context
-
-            if isinstance(self.generator, nn.ModuleList):
-                dec_out = self.generator[0](dec_out)
-                # gen_t = self.generator[0](dec_out)['logits']
-            else:
-                dec_out = self.generator(dec_out)
-            gen_t = dec_out['logits']
-            if dec_out['softmaxed'] is False:
-                gen_t = F.log_softmax(gen_t, dim=-1, dtype=torch.float32)
-            gen_t = gen_t.squeeze(0)
-            tgt_t = tgt_t.unsqueeze(1)
-            scores = gen_t.gather(1, tgt_t)
-            scores.masked_fill_(tgt_t.eq(onmt.constants.TGT_PAD), 0)
-            gold_scores += scores.squeeze(1).type_as(gold_scores)
-            gold_words += tgt_t.ne(onmt.constants.TGT_PAD).sum().item()
-            allgold_scores.append(scores.squeeze(1).type_as(gold_scores))
+        if isinstance(self.generator, nn.ModuleList):
+            dec_out = self.generator[0](dec_out)
+            # gen_t = self.generator[0](dec_out)['logits']
+        else:
+            dec_out = self.generator(dec_out)
+        gen = dec_out['logits']
+        if dec_out['softmaxed'] is False:
+            gen = F.log_softmax(gen, dim=-1, dtype=torch.float32)
+        # len_tgt x batch_size
+        scores = gen.gather(2, tgt_output.unsqueeze(2)).squeeze(2)
+        scores.masked_fill_(tgt_output.eq(onmt.constants.TGT_PAD), 0)
+        scores = scores.type_as(gold_scores)
+        gold_scores += scores.sum(0)
+        gold_words += tgt_output.ne(onmt.constants.TGT_PAD).sum().item()
+        allgold_scores = list(scores.unbind(0))
 
         return gold_words, gold_scores, allgold_scores
 
@@ -824,6 +822,10 @@ class TransformerDecodingState(DecoderState):
         self.attention_buffers = dict()
         self.buffering = buffering
         self.dec_pretrained_model = dec_pretrained_model
+        # source padding mask (B x 1 x T) computed by the decoder at the first step and reused afterwards
+        self.src_pad_mask = None
+        # when the source is cloned over the beam, every hypothesis of a sentence shares the same source side
+        self.shared_source = (type == 2 and cloning)
 
         if type == 1:
             # if audio only take one dimension since only used for mask
@@ -942,6 +944,7 @@ class TransformerDecodingState(DecoderState):
         self.context = update_active_with_hidden(self.context)
 
         self.input_seq = update_active_without_hidden(self.input_seq)
+        self.src_pad_mask = None
 
         if self.src.dim() == 2:
             self.src = update_active_without_hidden(self.src)
@@ -963,17 +966,26 @@ class TransformerDecodingState(DecoderState):
     # For the new decoder version only
     def _reorder_incremental_state(self, reorder_state):
 
-        if self.context is not None:
-            self.context = self.context.index_select(1, reorder_state)
+        # the beam search only moves hypotheses within their own sentence unless finished sentences are removed,
+        # so the shared source side (context, masks, encoder-decoder keys and values) is left untouched
+        reorder_source = not self.shared_source or reorder_state.numel() != self.src.size(1)
+
+        if reorder_source:
+            if self.context is not None:
+                self.context = self.context.index_select(1, reorder_state)
 
-        if self.src_mask is not None:
-            self.src_mask = self.src_mask.index_select(0, reorder_state)
-        self.src = self.src.index_select(1, reorder_state)
+            if self.src_mask is not None:
+                self.src_mask = self.src_mask.index_select(0, reorder_state)
+            if self.src_pad_mask is not None:
+                self.src_pad_mask = self.src_pad_mask.index_select(0, reorder_state)
+            self.src = self.src.index_select(1, reorder_state)
 
         for l in self.attention_buffers:
             buffer_ = self.attention_buffers[l]
             if buffer_ is not None:
                 for k in buffer_.keys():
+                    if not reorder_source and k in ['c_k', 'c_v']:
+                        continue
                     t_, br_, d_ = buffer_[k].size()
                     if not self.dec_pretrained_model:
                         buffer_[k] = buffer_[k].index_select(1, reorder_state)  # 1 for time first
@@ -37,11 +37,13 @@ class MultiHeadAttention(nn.Module):
 
     """
 
-    def __init__(self, h, d_model, attn_p=0.1, static=False, share=3):
+    def __init__(self, h, d_model, attn_p=0.1, static=False, share=3, sdpa=False):
         super(MultiHeadAttention, self).__init__()
         self.h = h
         self.d = d_model
         self.share = share
+        # F.scaled_dot_product_attention in training (no attention weights, coverage is None)
+        self.sdpa = sdpa and not static and hasattr(F, 'scaled_dot_product_attention')
 
         assert d_model % h == 0
 
@@ -50,6 +52,9 @@ class MultiHeadAttention(nn.Module):
         self.fc_key = Bottle(Linear(d_model, h * self.d_head, bias=False))
         self.fc_value = Bottle(Linear(d_model, h * self.d_head, bias=False))
         self.fc_concat = Bottle(Linear(h * self.d_head, d_model, bias=False))
+        # weight norm only recomputes .weight in the forward of the linear layers,
+        # so the packed key/value projection (which reads .weight directly) cannot be used with it
+        self.fused_kv = not (self.fc_key.function.weight_norm or self.fc_value.function.weight_norm)
 
         self.sm = nn.Softmax(dim=-1)
 
@@ -94,10 +99,13 @@ class MultiHeadAttention(nn.Module):
                 proj_key = incremental_cache['c_k']
                 proj_value = incremental_cache['c_v']
             else:
-                # shared_kv = group_linear([self.fc_key.function.linear, self.fc_value.function.linear], key)
-                # proj_key, proj_value = shared_kv.chunk(2, dim=-1)
-                proj_key = self.fc_key(key)
-                proj_value = self.fc_value(value)
+                if key is value and self.fused_kv:
+                    # one GEMM over the source for both projections
+                    shared_kv = group_linear([self.fc_key.function.linear, self.fc_value.function.linear], key)
+                    proj_key, proj_value = shared_kv.chunk(2, dim=-1)
+                else:
+                    proj_key = self.fc_key(key)
+                    proj_value = self.fc_value(value)
                 if incremental:
                     incremental_cache['c_k'] = proj_key
                     incremental_cache['c_v'] = proj_value
@@ -107,6 +115,10 @@ class MultiHeadAttention(nn.Module):
             proj_key = self.fc_key(key)  # batch_size x len_key x h*d_head
             proj_value = self.fc_value(value)  # batch_size x len_key x h*d_head
 
+        if self.sdpa and self.training and not incremental:
+            out = self.scaled_dot_product_attention(proj_query, proj_key, proj_value, mask)
+            return self.fc_concat(out), None
+
         q, k, v = proj_query, proj_key, proj_value
         len_key, b_ = k.size(0), k.size(1)
         # prepare the shape for applying softmax
@@ -139,3 +151,29 @@ class MultiHeadAttention(nn.Module):
         out = self.fc_concat(out)
 
         return out, coverage
+
+    def scaled_dot_product_attention(self, proj_query, proj_key, proj_value, mask):
+        """
+        Attention through F.scaled_dot_product_attention, which dispatches to the flash /
+        memory efficient kernels and never materializes the len_query x len_key matrix
+
+        :param proj_query: len_query x batch_size x h*d_head
+        :param proj_key: len_key x batch_size x h*d_head
+        :param proj_value: len_key x batch_size x h*d_head
+        :param mask: batch_size x len_query x len_key or broadcastable, True at the masked positions
+        :return: len_query x batch_size x d_model (before fc_concat)
+        """
+        len_query, b, len_key = proj_query.size(0), proj_query.size(1), proj_key.size(0)
+
+        # T x B x H -> B x h x T x d_head
+        q = proj_query.view(len_query, b, self.h, self.d_head).permute(1, 2, 0, 3)
+        k = proj_key.view(len_key, b, self.h, self.d_head).permute(1, 2, 0, 3)
+        v = proj_value.view(len_key, b, self.h, self.d_head).permute(1, 2, 0, 3)
+
+        # sdpa expects True at the positions that take part in the attention
+        attn_mask = mask.unsqueeze(-3).logical_not() if mask is not None else None
+
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask,
+                                             dropout_p=self.attn_dropout.p if self.training else 0.0)
+
+        return out.permute(2, 0, 1, 3).reshape(len_query, b, self.d)
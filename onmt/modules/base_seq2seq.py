@@ -82,45 +82,40 @@ class NMTModel(nn.Module):
         """
         override this method to have back-compatibility
         """
-        
+
+        # restore old generated if necessary for loading
+        if "generator.linear.weight" in state_dict and type(self.generator) is nn.ModuleList:
+            self.generator = self.generator[0]
+
+        model_dict = self.state_dict()
+
+        # decided once instead of for every key
+        skip_time_transformer = self.encoder is not None and \
+            (getattr(self.encoder, "enc_pretrained_model", None) or
+             getattr(self.encoder, "time", None) == 'positional_encoding')
+
         def condition(param_name):
             # don't load these buffers (more like a bug)
             if 'positional_encoder' in param_name:
                 return False
-            if 'time_transformer' in param_name:
-                if self.encoder is not None:
-                    if getattr(self.encoder, "enc_pretrained_model", None) or self.encoder.time == 'positional_encoding':
-                        return False
+            if skip_time_transformer and 'time_transformer' in param_name:
+                return False
             if param_name == 'decoder.mask':
                 return False
             if param_name == 'decoder.r_w_bias' or param_name == 'decoder.r_r_bias':
-                if param_name in model_dict:
-                    return True
-                return False
-            
-            return True
+                return param_name in model_dict
 
-        # restore old generated if necessary for loading
-        if "generator.linear.weight" in state_dict and type(self.generator) is nn.ModuleList:
-            self.generator = self.generator[0]
-
-        model_dict = self.state_dict()
+            return True
 
         # only load the filtered parameters
         filtered = {k: v for k, v in state_dict.items() if condition(k)}
 
-        for k, v in model_dict.items():
-            if k not in filtered:
-                filtered[k] = v
+        # the parameters missing in the checkpoint keep their current values
+        filtered.update({k: model_dict[k] for k in model_dict.keys() - filtered.keys()})
 
         # removing the keys in filtered but not in model dict
         if strict:
-            removed_keys = list()
-            for k, v in filtered.items():
-                if k not in model_dict:
-                    removed_keys.append(k)
-
-            for k in removed_keys:
+            for k in filtered.keys() - model_dict.keys():
                 filtered.pop(k)
 
         super().load_state_dict(filtered)   
@@ -68,8 +68,9 @@ class ScaleMixtureGaussian(object):
         self.gaussian2 = torch.distributions.Normal(0, sigma2)
 
     def log_prob(self, input):
-        # input = input.float()  # for exp better to cast to float
-        # print(input.type())
-        prob1 = torch.exp(self.gaussian1.log_prob(input))
-        prob2 = torch.exp(self.gaussian2.log_prob(input))
-        return (torch.log(self.pi * prob1 + (1 - self.pi) * prob2)).sum()
+        # log(pi * p1 + (1 - pi) * p2) in log space: no exp/log round trip over the weights
+        # (which also underflows to log(0) far from the mean)
+        log_pi1 = math.log(self.pi) if self.pi > 0 else -math.inf
+        log_pi2 = math.log(1 - self.pi) if self.pi < 1 else -math.inf
+        return torch.logaddexp(self.gaussian1.log_prob(input) + log_pi1,
+                               self.gaussian2.log_prob(input) + log_pi2).sum()
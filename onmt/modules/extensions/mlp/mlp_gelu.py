@@ -226,6 +226,9 @@ def agelu_backward(x, dy):
 
 if __name__ == '__main__':
 
+    # the activation ids implemented by mlp_cuda, the kernels of this extension always apply gelu
+    ACTIVATIONS = {'relu': 1, 'sigmoid': 2, 'gelu': 3}
+
     class MLP(torch.nn.Module):
         """Launch MLP in C++
 
@@ -241,26 +244,14 @@ if __name__ == '__main__':
             self.mlp_sizes = copy(mlp_sizes)
             self.dropout = dropout
 
-            if activation is 'relu':
-                self.activation = 1
-            elif activation is 'sigmoid':
-                self.activation = 2
-            elif activation is 'gelu':
-                self.activation = 3
-            else:
-                raise TypeError("activation must be relu or none.")
-
-            self.weights = []
-            self.biases = []
-            for i in range(self.num_layers):
-                w = torch.nn.Parameter(torch.empty(mlp_sizes[i + 1], mlp_sizes[i]))
-                self.weights.append(w)
-                name = 'weight_{}'.format(i)
-                setattr(self, name, w)
-                b = torch.nn.Parameter(torch.empty(mlp_sizes[i + 1]))
-                self.biases.append(b)
-                name = 'bias_{}'.format(i)
-                setattr(self, name, b)
+            if activation not in ACTIVATIONS:
+                raise ValueError("activation must be one of %s." % ", ".join(ACTIVATIONS))
+            self.activation = ACTIVATIONS[activation]
+
+            self.weights = torch.nn.ParameterList(
+                [torch.nn.Parameter(torch.empty(mlp_sizes[i + 1], mlp_sizes[i])) for i in range(self.num_layers)])
+            self.biases = torch.nn.ParameterList(
+                [torch.nn.Parameter(torch.empty(mlp_sizes[i + 1])) for i in range(self.num_layers)])
 
             self.reset_parameters()
 
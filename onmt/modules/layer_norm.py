@@ -36,6 +36,15 @@ except (ModuleNotFoundError, ImportError) as e:
     fast_fused = False
     # print("[INFO] Fast layer norm implementation not found.")
 
+try:
+    from apex.normalization.fused_layer_norm import fused_rms_norm_affine
+except (ModuleNotFoundError, ImportError) as e:
+    fused_rms_norm_affine = None
+
+# hidden sizes with a (persistent) kernel in apex's fast layer norm
+FAST_LAYER_NORM_SIZES = {1024, 1536, 2048, 2304, 3072, 3840, 4096, 5120, 6144, 8192, 10240, 12288, 12800,
+                         15360, 16384, 18432, 20480, 24576, 25600, 30720, 32768, 40960, 49152, 65536}
+
 
 class FastLayerNormFN(torch.autograd.Function):
     @staticmethod
@@ -204,8 +213,8 @@ class LayerNorm(torch.nn.Module):
                 input, self.normalized_shape, self.weight, self.bias, eps)
         if self.elementwise_affine:
 
-            # at the moment the super fast layer norm only supports hidden size 1024 :)
-            if fast_fused and input.size(-1) == 1024:
+            # the super fast layer norm only supports some hidden sizes
+            if fast_fused and input.size(-1) in FAST_LAYER_NORM_SIZES:
                 return fast_layer_norm_affine(input, self.weight, self.bias, self.normalized_shape, eps)
 
             return FusedLayerNormAffineFunction.apply(
@@ -218,6 +227,50 @@ class LayerNorm(torch.nn.Module):
                'elementwise_affine={elementwise_affine}'.format(**self.__dict__)
 
 
+class RMSNorm(torch.nn.Module):
+    """
+    Root mean square layer norm: the input is only rescaled by its RMS (no mean, no bias),
+    which saves the mean reduction of the layer norm. Uses apex's fused kernel if available.
+    """
+
+    def __init__(self, normalized_shape, eps=1e-5, elementwise_affine=True):
+        super().__init__()
+
+        if isinstance(normalized_shape, numbers.Integral):
+            normalized_shape = (normalized_shape,)
+        self.normalized_shape = torch.Size(normalized_shape)
+        self.eps = eps
+        self.elementwise_affine = elementwise_affine
+        if self.elementwise_affine:
+            self.weight = Parameter(torch.Tensor(*normalized_shape))
+        else:
+            self.register_parameter('weight', None)
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        if self.elementwise_affine:
+            init.ones_(self.weight)
+
+    def forward(self, input):
+
+        if fused_rms_norm_affine is not None and input.is_cuda and self.elementwise_affine:
+            return fused_rms_norm_affine(input, self.weight, self.normalized_shape, self.eps)
+
+        dims = tuple(range(-len(self.normalized_shape), 0))
+        variance = input.float().pow(2).mean(dims, keepdim=True)
+        output = input.float() * torch.rsqrt(variance + self.eps)
+
+        # the weight is applied before casting back, so that half precision inputs stay in half precision
+        if self.elementwise_affine:
+            output = output * self.weight.float()
+
+        return output.type_as(input)
+
+    def extra_repr(self):
+        return '{normalized_shape}, eps={eps}, ' \
+               'elementwise_affine={elementwise_affine}'.format(**self.__dict__)
+
+
 class MultilingualLayerNorm(torch.nn.Module):
     """
     See LayerNorm for details.
@@ -45,135 +45,49 @@ except (ModuleNotFoundError, ImportError) as e:
     fused_mlp_gelu_dropout_add = None
 
 
-class MlpReluFunction(torch.autograd.Function):
-    @staticmethod
-    # @custom_fwd(cast_inputs=torch.float16)
-    @custom_fwd
-    def forward(ctx, p, *args):
-        output = fused_mlp_relu.forward(p, args)
-        ctx.save_for_backward(*args)
-        ctx.outputs = output
-        dropout_mask = output[-1]
-        ctx.p = p
-        return output[0]
-
-    @staticmethod
-    @custom_bwd
-    def backward(ctx, *grad_o):
-        p = ctx.p
-        grads = fused_mlp_relu.backward(p, grad_o[0], ctx.outputs, ctx.saved_tensors)
-        del ctx.outputs
-        return (None, *grads)
-
-
-if fused_mlp_relu:
-    mlp_relu_function = half_function(MlpReluFunction.apply)
-else:
-    mlp_relu_function = None
-
-
-class MlpSiluFunction(torch.autograd.Function):
-    @staticmethod
-    @custom_fwd
-    def forward(ctx, p, *args):
-        output = fused_mlp_silu.forward(p, args)
-        ctx.save_for_backward(*args)
-        ctx.outputs = output
-        dropout_mask = output[-1]
-        ctx.p = p
-        return output[0]
-
-    @staticmethod
-    @custom_bwd
-    def backward(ctx, *grad_o):
-        p = ctx.p
-        grads = fused_mlp_silu.backward(p, grad_o[0], ctx.outputs, ctx.saved_tensors)
-        del ctx.outputs
-        return (None, *grads)
-
-
-if fused_mlp_silu:
-    mlp_silu_function = half_function(MlpSiluFunction.apply)
-else:
-    mlp_silu_function = None
+# the fused MLP extensions share the same interface and only differ in the activation
+_BACKENDS = {
+    'relu': fused_mlp_relu,
+    'silu': fused_mlp_silu,
+    'gelu': fused_mlp_gelu,
+    'agelu': fused_mlp_agelu,
+}
 
 
-class MlpGELUFunction(torch.autograd.Function):
+class FusedMlpFunction(torch.autograd.Function):
     @staticmethod
     @custom_fwd
-    def forward(ctx, p, *args):
-        output = fused_mlp_gelu.forward(p, args)
+    def forward(ctx, activation, p, *args):
+        output = _BACKENDS[activation].forward(p, args)
         ctx.save_for_backward(*args)
         ctx.outputs = output
-        dropout_mask = output[-1]
         ctx.p = p
+        ctx.activation = activation
         return output[0]
 
     @staticmethod
     @custom_bwd
     def backward(ctx, *grad_o):
         p = ctx.p
-        grads = fused_mlp_gelu.backward(p, grad_o[0], ctx.outputs, ctx.saved_tensors)
+        grads = _BACKENDS[ctx.activation].backward(p, grad_o[0], ctx.outputs, ctx.saved_tensors)
         del ctx.outputs
-        return (None, *grads)
-
-
-if fused_mlp_gelu:
-    mlp_gelu_function = half_function(MlpGELUFunction.apply)
-else:
-    mlp_gelu_function = None
-
-
-class MlpAGELUFunction(torch.autograd.Function):
-    @staticmethod
-    @custom_fwd
-    def forward(ctx, p, *args):
-        output = fused_mlp_agelu.forward(p, args)
-        ctx.save_for_backward(*args)
-        ctx.outputs = output
-        dropout_mask = output[-1]
-        ctx.p = p
-        return output[0]
-
-    @staticmethod
-    @custom_bwd
-    def backward(ctx, *grad_o):
-        p = ctx.p
-        grads = fused_mlp_agelu.backward(p, grad_o[0], ctx.outputs, ctx.saved_tensors)
-        del ctx.outputs
-        return (None, *grads)
-
+        return (None, None, *grads)
 
-if fused_mlp_gelu:
-    mlp_agelu_function = half_function(MlpAGELUFunction.apply)
-else:
-    mlp_agelu_function = None
 
+def _fused_mlp_function(activation):
+    if _BACKENDS[activation] is None:
+        return None
 
-class MlpGELUFunction(torch.autograd.Function):
-    @staticmethod
-    @custom_fwd
-    def forward(ctx, p, *args):
-        output = fused_mlp_gelu.forward(p, args)
-        ctx.save_for_backward(*args)
-        ctx.outputs = output
-        dropout_mask = output[-1]
-        ctx.p = p
-        return output[0]
+    def fused_mlp_function(p, *args):
+        return FusedMlpFunction.apply(activation, p, *args)
 
-    @staticmethod
-    @custom_bwd
-    def backward(ctx, *grad_o):
-        p = ctx.p
-        grads = fused_mlp_gelu.backward(p, grad_o[0], ctx.outputs, ctx.saved_tensors)
-        del ctx.outputs
-        return (None, *grads)
+    return half_function(fused_mlp_function)
 
 
-if fused_mlp_gelu:
-    mlp_gelu_function = half_function(MlpGELUFunction.apply)
-else:
-    mlp_gelu_function = None
+mlp_relu_function = _fused_mlp_function('relu')
+mlp_silu_function = _fused_mlp_function('silu')
+mlp_gelu_function = _fused_mlp_function('gelu')
+mlp_agelu_function = _fused_mlp_function('agelu')
 
 
 class MlpGeLUDropoutAddFunction(torch.autograd.Function):
@@ -1,10 +1,10 @@
 import torch
 import torch.nn as nn
-from .layer_norm import LayerNorm, MultilingualLayerNorm
+from .layer_norm import LayerNorm, MultilingualLayerNorm, RMSNorm
 import onmt
 from onmt.modules.dropout import VariationalDropout
 from onmt.modules.bottle import Bottle
-# from onmt.modules.optimized.dropout_add import fused_dropout_add
+from onmt.modules.optimized.dropout_add import fused_dropout_add, fused_dropout_add_cuda
 
 
 class PrePostProcessing(nn.Module):
@@ -16,10 +16,11 @@ class PrePostProcessing(nn.Module):
             n = normalization
             d = dropout
             a = adding previous input to output (residual)
+        norm_type: 'layernorm' or 'rmsnorm' (normalization without mean and bias)
     """
 
     def __init__(self, d_model, dropout_p, sequence='nda', variational=False, elementwise_affine=True,
-                 multilingual=False, n_languages=1):
+                 multilingual=False, n_languages=1, norm_type='layernorm'):
         super(PrePostProcessing, self).__init__()
         self.d_model = d_model
         self.dropout_p = dropout_p
@@ -34,7 +35,10 @@ class PrePostProcessing(nn.Module):
 
         if 'n' in self.steps:
             if not multilingual:
-                ln = LayerNorm((self.d_model,), elementwise_affine=elementwise_affine)
+                if norm_type == 'rmsnorm':
+                    ln = RMSNorm((self.d_model,), elementwise_affine=elementwise_affine)
+                else:
+                    ln = LayerNorm((self.d_model,), elementwise_affine=elementwise_affine)
                 self.layer_norm = Bottle(ln)
             else:
                 ln = MultilingualLayerNorm((self.d_model,), eps=1e-5, elementwise_affine=True, n_languages=n_languages)
@@ -44,19 +48,32 @@ class PrePostProcessing(nn.Module):
                 self.dropout = VariationalDropout(self.dropout_p, batch_first=False)
             else:
                 self.dropout = nn.Dropout(self.dropout_p, inplace=False)
+
+        # dropout + residual in one kernel (only when the CUDA extension is built)
+        self.fused_dropout_add = sequence == 'da' and not variational and fused_dropout_add_cuda is not None
         if 'z' in self.steps:
             # Rezero residual method
             self.g = nn.Parameter(torch.tensor(0.0))
 
-    def forward(self, tensor, input_tensor=None, mask=None, factor=None):
+    def forward(self, tensor, input_tensor=None, mask=None, factor=None, scale=1.0):
         """
         :param tensor: input tensor [BxTxH] or [TxBxH (most likely)]
         :param input_tensor: previous tensor for residual
         :param mask: unused
         :param factor: tensor size 1, for multilingual
+        :param scale: python float multiplying the tensor at the residual step (e.g. stochastic depth),
+                      folded into the residual add
         :return:
         """
 
+        # the fused kernel only handles half precision, mixed precision inputs keep the unfused path
+        # (which promotes the residual add instead of rounding the residual stream to half)
+        if self.fused_dropout_add and input_tensor is not None and tensor.is_cuda \
+                and tensor.dtype == input_tensor.dtype == torch.half:
+            if scale != 1.0:
+                tensor = tensor * scale
+            return fused_dropout_add(tensor, input_tensor, self.dropout_p, self.training)
+
         output = tensor
 
         i = 0
@@ -72,11 +89,21 @@ class PrePostProcessing(nn.Module):
             if step == 'd':
                 output = self.dropout(output)
             if step == 'a':
-                if input_tensor is not None:
-                    output = output + input_tensor
+                output = self._residual(output, input_tensor, scale)
             if step == 'z':  # rezero-residual but scaling the output with initially small g
                 output = output * self.g
-                if input_tensor is not None:
-                    output = output + input_tensor
+                output = self._residual(output, input_tensor, scale)
             i = i + 1
         return output
+
+    @staticmethod
+    def _residual(output, input_tensor, scale):
+
+        if input_tensor is None:
+            return output if scale == 1.0 else output * scale
+
+        if scale == 1.0:
+            return output + input_tensor
+
+        # input_tensor + scale * output in one kernel
+        return torch.add(input_tensor, output, alpha=scale)
@@ -215,13 +215,13 @@ class RelPartialLearnableMultiHeadAttn(nn.Module):
         attn_score = attn_score.transpose(0, 2).transpose(1, 3)
 
         # compute attention probability
-        if attn_mask is not None and attn_mask.any().item():
+        # (no attn_mask.any() check: it would sync with the device, and -inf is exact in every float dtype,
+        # the softmax below is computed in float32 anyway)
+        if attn_mask is not None:
             if attn_mask.dim() == 2:
-                attn_score = attn_score.float().masked_fill(
-                    attn_mask[None, :, :, None], -float('inf')).type_as(attn_score)
+                attn_score = attn_score.masked_fill(attn_mask[None, :, :, None], -float('inf'))
             elif attn_mask.dim() == 3:
-                attn_score = attn_score.float().masked_fill(
-                    attn_mask[:, :, :, None], -float('inf')).type_as(attn_score)
+                attn_score = attn_score.masked_fill(attn_mask[:, :, :, None], -float('inf'))
 
         # [bsz x n_head x qlen x klen] again
         attn_score = attn_score.transpose(0, 2).transpose(1, 3)
@@ -412,14 +412,12 @@ class LearnableRelMultiHeadAttn(nn.Module):
         # [qlen x klen x bsz x n_head]
         attn_score = attn_score.transpose(0, 2).transpose(1, 3)
 
-        # compute attention probability
-        if attn_mask is not None and attn_mask.any().item():
+        # compute attention probability (see RelPartialLearnableMultiHeadAttn for the missing any() check)
+        if attn_mask is not None:
             if attn_mask.dim() == 2:
-                attn_score = attn_score.float().masked_fill(
-                    attn_mask[None, :, :, None], -float('inf')).type_as(attn_score)
+                attn_score = attn_score.masked_fill(attn_mask[None, :, :, None], -float('inf'))
             elif attn_mask.dim() == 3:
-                attn_score = attn_score.float().masked_fill(
-                    attn_mask[:, :, :, None], -float('inf')).type_as(attn_score)
+                attn_score = attn_score.masked_fill(attn_mask[:, :, :, None], -float('inf'))
 
         # [bsz x n_head x qlen x klen] again
         attn_score = attn_score.transpose(0, 2).transpose(1, 3)
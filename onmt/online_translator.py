@@ -1,6 +1,16 @@
 import onmt
 import onmt.modules
 
+# options that can be set in the translator config file and their types
+_FILE_OPTIONS = {
+    "model": str,
+    "beam_size": int,
+    "src_lang": str,
+    "tgt_lang": str,
+    "no_repeat_ngram_size": int,
+    "dynamic_quantile": int,
+}
+
 
 class TranslatorParameter(object):
 
@@ -51,28 +61,12 @@ class TranslatorParameter(object):
 
     def read_file(self, filename):
 
-        f = open(filename)
-
-        line = f.readline()
-
-        while line:
-
-            w = line.strip().split()
-
-            if w[0] == "model":
-                self.model = w[1]
-            elif w[0] == "beam_size":
-                self.beam_size = int(w[1])
-            elif w[0] == "src_lang":
-                self.src_lang = w[1]
-            elif w[0] == "tgt_lang":
-                self.tgt_lang = w[1]
-            elif w[0] == "no_repeat_ngram_size":
-                self.no_repeat_ngram_size = int(w[1])
-            elif w[0] == "dynamic_quantile":
-                self.dynamic_quantile = int(w[1])
+        with open(filename) as f:
+            options = [line.split() for line in f]
 
-            line = f.readline()
+        for w in options:
+            if len(w) > 1 and w[0] in _FILE_OPTIONS:
+                setattr(self, w[0], _FILE_OPTIONS[w[0]](w[1]))
 
 
 class OnlineTranslator(object):
@@ -80,9 +74,10 @@ class OnlineTranslator(object):
         opt = TranslatorParameter(model)
         from onmt.inference.fast_translator import FastTranslator
         self.translator = FastTranslator(opt)
+        # whitespace tokenization, can be replaced by another tokenizer (e.g. BPE) once here
+        self.tokenize = str.split
 
     def translate(self, input):
-        predBatch, predScore, predLength, goldScore, numGoldWords, allGoldScores = \
-            self.translator.translate([input.split()], [])
+        predBatch, *_ = self.translator.translate([self.tokenize(input)], [])
 
         return " ".join(predBatch[0][0])
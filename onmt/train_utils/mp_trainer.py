@@ -26,6 +26,7 @@ from onmt.utils import checkpoint_paths, normalize_gradients
 from onmt.model_factory import build_model, optimize_model, init_model_parameters
 import torch.distributed as dist
 from torch.nn.parallel import DistributedDataParallel as DDP_model
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
 from torch.cuda.amp import autocast
 import warnings
 
@@ -86,29 +87,16 @@ def all_reduce_and_rescale_tensors(tensors, rescale_denom,
         rescale_denom: denominator for rescaling summed Tensors
         buffer_size: all-reduce chunk size in bytes
     """
-    # buffer size in bytes, determine equiv. # of elements based on data type
-    buffer_t = tensors[0].new(
-        math.ceil(buffer_size / tensors[0].element_size())).zero_()
     buffer = []
 
     def all_reduce_buffer():
-        # copy tensors into buffer_t
-        offset = 0
-        for t in buffer:
-            numel = t.numel()
-            buffer_t[offset:offset + numel].copy_(t.view(-1))
-            offset += numel
-
-        # all-reduce and rescale
-        torch.distributed.all_reduce(buffer_t[:offset])
-        buffer_t.div_(rescale_denom)
-
-        # copy all-reduced buffer back into tensors
-        offset = 0
-        for t in buffer:
-            numel = t.numel()
-            t.view(-1).copy_(buffer_t[offset:offset + numel])
-            offset += numel
+        # flatten the bucket with a single kernel, reduce it and copy the results back through views
+        flat = _flatten_dense_tensors(buffer)
+        torch.distributed.all_reduce(flat)
+        flat.div_(rescale_denom)
+
+        for t, reduced in zip(buffer, _unflatten_dense_tensors(flat, buffer)):
+            t.copy_(reduced)
 
     with torch.no_grad():
         filled = 0
@@ -132,6 +120,22 @@ def all_reduce_and_rescale_tensors(tensors, rescale_denom,
             all_reduce_buffer()
 
 
+def load_grad_scaler_state(grad_scaler, state):
+    """
+    Restore the state of the grad scaler from a checkpoint.
+    A disabled scaler (-bf16) saves an empty state, which cannot be loaded into an enabled one
+    (resuming without -bf16): the scaler then simply starts from its initial scale.
+    :param grad_scaler: torch.cuda.amp.GradScaler
+    :param state: the 'scaler' entry of the checkpoint (may be None or empty)
+    :return: True if the state was loaded
+    """
+    if not state or not grad_scaler.is_enabled():
+        return False
+
+    grad_scaler.load_state_dict(state)
+    return True
+
+
 class Trainer(object):
 
     def __init__(self, device, train_data, valid_data, dicts, opt, setup_optimizer=True):
@@ -218,13 +222,14 @@ class Trainer(object):
         init_model_parameters(model, opt)
         self.model = model
         self.loss_function = loss_function
-        self.grad_scaler = torch.cuda.amp.GradScaler()
+        # bfloat16 has the same dynamic range as float32, so the loss does not need to be scaled
+        self.amp_dtype = torch.bfloat16 if getattr(opt, 'bf16', False) else torch.float16
+        self.grad_scaler = torch.cuda.amp.GradScaler(enabled=not getattr(opt, 'bf16', False))
 
         if opt.load_from:
             checkpoint = torch.load(opt.load_from, map_location=lambda storage, loc: storage)
             self.model.load_state_dict(checkpoint['model'])
-            if 'scaler' in checkpoint and checkpoint['scaler'] is not None:
-                self.grad_scaler.load_state_dict(checkpoint['scaler'])
+            load_grad_scaler_state(self.grad_scaler, checkpoint.get('scaler'))
 
         if self.cuda:
             torch.cuda.set_device(self.device)
@@ -405,7 +410,7 @@ class Trainer(object):
             streaming_state = None
 
         try:
-            with autocast():
+            with autocast(dtype=self.amp_dtype):
                 targets = batch.get('target_output')
                 tgt_mask = None
                 outputs = self.model(batch, streaming=opt.streaming, target_mask=tgt_mask,
@@ -574,7 +579,7 @@ class Trainer(object):
                 samples = next(epoch_iterator)
 
                 if samples:
-                    with autocast():
+                    with autocast(dtype=self.amp_dtype):
                         batch = prepare_sample(samples, device=self.device)
                         targets = batch.get('target_output')
                         tgt_mask = targets.ne(onmt.constants.PAD)
@@ -680,7 +685,7 @@ class Trainer(object):
                         return contextlib.ExitStack()  # dummy contextmanager
 
                 with maybe_no_sync():
-                    with autocast():
+                    with autocast(dtype=self.amp_dtype):
                         targets = batch.get('target_output')
                         tgt_mask = targets.ne(onmt.constants.PAD)
                         outputs = self.model(batch, streaming=opt.streaming, target_mask=tgt_mask,
@@ -750,7 +755,8 @@ class Trainer(object):
                     if opt.streaming:  # reset stream in this case ...
                         streaming_state = self.model.init_stream()
 
-                    self.grad_scaler._check_inf_per_device(self.optim.optimizer)
+                    if self.grad_scaler.is_enabled():
+                        self.grad_scaler._check_inf_per_device(self.optim.optimizer)
                     # raise e
                 # else:
                 #     raise e
@@ -832,9 +838,12 @@ class Trainer(object):
             # control the index a little bit to ensure the log is always printed
             if i == 0 or ((i + 1) % opt.log_interval < self.world_size):
 
-                self.all_reduce(report_loss, op=dist.ReduceOp.SUM, group=self.group)
-                self.all_reduce(report_tgt_words, op=dist.ReduceOp.SUM, group=self.group)
-                self.all_reduce(report_src_words, op=dist.ReduceOp.SUM, group=self.group)
+                # sum the reported statistics over the processes with a single collective on every rank
+                report_stats = [report_loss, report_tgt_words, report_src_words, report_rec_loss, report_rev_loss]
+                flat_stats = _flatten_dense_tensors(report_stats)
+                self.all_reduce(flat_stats, op=dist.ReduceOp.SUM, group=self.group)
+                for stat, reduced in zip(report_stats, _unflatten_dense_tensors(flat_stats, report_stats)):
+                    stat.copy_(reduced)
 
                 if self.is_main():
                     log_string = ("Epoch %2d, %5d/%5d; ; ppl: %6.2f ; " %
@@ -842,12 +851,10 @@ class Trainer(object):
                                    math.exp(report_loss.item() / report_tgt_words.item())))
 
                     if opt.reconstruct:
-                        self.all_reduce(report_rec_loss, op=dist.ReduceOp.SUM, group=self.group)
                         rec_ppl = math.exp(report_rec_loss.item() / report_src_words.item())
                         log_string += (" rec_ppl: %6.2f ; " % rec_ppl)
 
                     if opt.mirror_loss:
-                        self.all_reduce(report_rev_loss, op=dist.ReduceOp.SUM, group=self.group)
                         rev_ppl = math.exp(report_rev_loss.item() / report_tgt_words.item())
                         log_string += (" rev_ppl: %6.2f ; " % rev_ppl)
                         log_string += (" mir_loss: %6.2f ; " % (report_mirror_loss / report_tgt_words))
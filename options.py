@@ -249,6 +249,9 @@ def make_parser(parser):
                         help='Use half precision training')
     parser.add_argument('-fp16_mixed', action='store_true',
                         help='Use mixed half precision training. fp16 must be enabled.')
+    parser.add_argument('-bf16', action='store_true',
+                        help='Run the autocast regions of distributed training in bfloat16 '
+                             'instead of float16 (no loss scaling is needed then).')
     parser.add_argument('-seed', default=-1, type=int,
                         help="Seed for deterministic runs.")
 
@@ -271,6 +274,12 @@ def make_parser(parser):
                         help="""Fast self attention between encoder decoder""")
     parser.add_argument('-fast_feed_forward', action="store_true",
                         help="""Fast cross attention between encoder decoder""")
+    parser.add_argument('-fast_feed_forward_decoder', action="store_true",
+                        help="""Use the fused position-wise feed-forward in the relative decoder layers.
+                        Not compatible with checkpoints trained without it.""")
+    parser.add_argument('-rms_norm', action="store_true",
+                        help="""Use RMSNorm (no mean, no bias) instead of LayerNorm
+                        before the sub-layers of the relative transformer layers.""")
     parser.add_argument('-macaron', action='store_true',
                         help='Macaron style network with 2 FFN per block.')
     parser.add_argument('-fused_ffn', action="store_true",
@@ -370,6 +379,25 @@ def make_parser(parser):
                         help='Using reversible models for encoder')
     parser.add_argument('-tgt_reversible', action='store_true',
                         help='Using reversible models for decoder')
+    parser.add_argument('-reversible_offload', action='store_true',
+                        help='Offload the activations saved by the reversible encoder/decoder to pinned CPU memory '
+                             'between the forward and the backward pass')
+    parser.add_argument('-attn_bf16', action='store_true',
+                        help='Run the SDPA source attention of the reversible decoder in bfloat16 '
+                             '(only with -sdpa_src_attention: the fused attention kernels always cast '
+                             'their inputs to float16 under autocast)')
+    parser.add_argument('-sdpa_src_attention', action='store_true',
+                        help='Use F.scaled_dot_product_attention (flash / memory efficient kernels) '
+                             'for the source attention of the reversible decoder during training')
+    parser.add_argument('-sdpa_attention', action='store_true',
+                        help='Use F.scaled_dot_product_attention (flash / memory efficient kernels) '
+                             'for the decoder attentions built on MultiHeadAttention during training')
+    parser.add_argument('-compile_layers', action='store_true',
+                        help='Run the layers of the relative transformer through torch.compile during training '
+                             '(fuses the small pointwise ops of every layer)')
+    parser.add_argument('-cuda_graph_layers', action='store_true',
+                        help='Capture every layer of the relative transformer in a CUDA graph (one per input shape) '
+                             'and replay it during training instead of launching the kernels one by one')
 
     parser.add_argument('-debugging', action='store_true',
                         help='Using reversible models for decoder')
@@ -576,6 +604,27 @@ def backward_compatible(opt):
     if not hasattr(opt, 'tgt_reversible'):
         opt.tgt_reversible = False
 
+    if not hasattr(opt, 'reversible_offload'):
+        opt.reversible_offload = False
+
+    if not hasattr(opt, 'sdpa_src_attention'):
+        opt.sdpa_src_attention = False
+
+    if not hasattr(opt, 'attn_bf16'):
+        opt.attn_bf16 = False
+
+    if not hasattr(opt, 'cuda_graph_layers'):
+        opt.cuda_graph_layers = False
+
+    if not hasattr(opt, 'sdpa_attention'):
+        opt.sdpa_attention = False
+
+    if not hasattr(opt, 'compile_layers'):
+        opt.compile_layers = False
+
+    if not hasattr(opt, 'bf16'):
+        opt.bf16 = False
+
     if not hasattr(opt, 'fast_xentropy'):
         opt.fast_xentropy = False
 
@@ -588,6 +637,12 @@ def backward_compatible(opt):
     if not hasattr(opt, 'fast_feed_forward'):
         opt.fast_feed_forward = False
 
+    if not hasattr(opt, 'fast_feed_forward_decoder'):
+        opt.fast_feed_forward_decoder = False
+
+    if not hasattr(opt, 'rms_norm'):
+        opt.rms_norm = False
+
     if not hasattr(opt, 'fused_ffn'):
         opt.fused_ffn = False
 
@@ -0,0 +1,60 @@
+import unittest
+
+import torch
+
+import onmt
+from onmt.modules.attention import MultiHeadAttention
+
+
+class TestMultiHeadAttentionSharedKV(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(1234)
+        self.len_q, self.len_k, self.bsz, self.d_model, self.h = 5, 7, 3, 16, 4
+
+    def tearDown(self):
+        onmt.constants.weight_norm = False
+
+    def _inputs(self):
+        query = torch.randn(self.len_q, self.bsz, self.d_model, dtype=torch.float64)
+        context = torch.randn(self.len_k, self.bsz, self.d_model, dtype=torch.float64)
+        return query, context
+
+    def _run(self, attn, query, key, value):
+        attn.zero_grad()
+        out, _ = attn(query, key, value, None)
+        out.sum().backward()
+        grads = [p.grad.clone() for p in attn.parameters()]
+        return out.detach(), grads
+
+    def test_fused_kv_matches_separate_projections(self):
+        onmt.constants.weight_norm = False
+        attn = MultiHeadAttention(self.h, self.d_model, attn_p=0.0, share=2).double()
+        self.assertTrue(attn.fused_kv)
+
+        query, context = self._inputs()
+        fused_out, fused_grads = self._run(attn, query, context, context)
+        # key is not value: separate projections
+        out, grads = self._run(attn, query, context, context.clone())
+
+        self.assertTrue(torch.allclose(fused_out, out))
+        for g_fused, g in zip(fused_grads, grads):
+            self.assertTrue(torch.allclose(g_fused, g))
+
+    def test_weight_norm_uses_separate_projections(self):
+        onmt.constants.weight_norm = True
+        attn = MultiHeadAttention(self.h, self.d_model, attn_p=0.0, share=2).double()
+        self.assertFalse(attn.fused_kv)
+
+        query, context = self._inputs()
+        out, _ = self._run(attn, query, context, context)
+        ref_out, _ = self._run(attn, query, context, context.clone())
+        self.assertTrue(torch.allclose(out, ref_out))
+
+        for linear in [attn.fc_key.function.linear, attn.fc_value.function.linear]:
+            self.assertIsNotNone(linear.weight_g.grad)
+            self.assertIsNotNone(linear.weight_v.grad)
+
+
+if __name__ == '__main__':
+    unittest.main()
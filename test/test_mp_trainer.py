@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.distributed as dist
+
+from onmt.train_utils.mp_trainer import load_grad_scaler_state, all_reduce_and_rescale_tensors
+
+
+class TestGradScalerResume(unittest.TestCase):
+
+    def test_bf16_checkpoint_into_disabled_scaler(self):
+        state = torch.cuda.amp.GradScaler(enabled=False).state_dict()
+        grad_scaler = torch.cuda.amp.GradScaler(enabled=False)
+
+        self.assertFalse(load_grad_scaler_state(grad_scaler, state))
+
+    def test_missing_scaler_state(self):
+        grad_scaler = torch.cuda.amp.GradScaler(enabled=False)
+
+        self.assertFalse(load_grad_scaler_state(grad_scaler, None))
+
+    @unittest.skipUnless(torch.cuda.is_available(), "the enabled GradScaler needs CUDA")
+    def test_bf16_checkpoint_into_fp16_scaler(self):
+        # trained with -bf16: the disabled scaler saves an empty state
+        state = torch.cuda.amp.GradScaler(enabled=False).state_dict()
+        self.assertEqual(len(state), 0)
+
+        # resumed without -bf16
+        grad_scaler = torch.cuda.amp.GradScaler()
+        init_scale = grad_scaler.get_scale()
+
+        self.assertFalse(load_grad_scaler_state(grad_scaler, state))
+        self.assertEqual(grad_scaler.get_scale(), init_scale)
+
+    @unittest.skipUnless(torch.cuda.is_available(), "the enabled GradScaler needs CUDA")
+    def test_fp16_checkpoint_into_fp16_scaler(self):
+        state = torch.cuda.amp.GradScaler(init_scale=1024.0).state_dict()
+        grad_scaler = torch.cuda.amp.GradScaler()
+
+        self.assertTrue(load_grad_scaler_state(grad_scaler, state))
+        self.assertEqual(grad_scaler.state_dict()['scale'], 1024.0)
+
+
+@unittest.skipUnless(dist.is_available(), "torch.distributed is not available")
+class TestAllReduceAndRescale(unittest.TestCase):
+    """
+    With a single (gloo, CPU) process the all-reduce is the identity,
+    so every tensor must come back divided by the denominator, whatever bucket it went through
+    """
+
+    def setUp(self):
+        self.init_file = tempfile.NamedTemporaryFile(delete=False)
+        self.init_file.close()
+        os.remove(self.init_file.name)
+        dist.init_process_group('gloo', init_method='file://' + self.init_file.name, rank=0, world_size=1)
+
+    def tearDown(self):
+        dist.destroy_process_group()
+        if os.path.exists(self.init_file.name):
+            os.remove(self.init_file.name)
+
+    def test_rescale_matches_per_tensor(self):
+        torch.manual_seed(1234)
+        shapes = [(3, 4), (5,), (64, 8), (2, 3, 2), (7,)]
+        tensors = [torch.randn(*shape) for shape in shapes]
+        expected = [t.clone().div_(4.0) for t in tensors]
+
+        # 256 bytes: the (64, 8) tensor is reduced on its own, the others are flattened in several buckets
+        all_reduce_and_rescale_tensors(tensors, 4.0, buffer_size=256)
+
+        for t, ref in zip(tensors, expected):
+            self.assertTrue(torch.allclose(t, ref))
+
+
+if __name__ == '__main__':
+    unittest.main()
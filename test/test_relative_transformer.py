@@ -0,0 +1,34 @@
+import argparse
+import unittest
+
+import torch
+
+import onmt
+from onmt.models.relative_transformer import StreamDecodingState
+
+
+class TestStreamDecodingState(unittest.TestCase):
+
+    def test_reorder_cached_src_pad_mask(self):
+        bsz, beam_size, len_src = 2, 3, 5
+        src = torch.randint(onmt.constants.PAD + 1, 100, (len_src, bsz))
+        src[-2:, 0] = onmt.constants.PAD
+        context = torch.randn(len_src, bsz, 8)
+
+        streaming_state = argparse.Namespace(src_buffer=dict(), tgt_buffer=dict(), src_mems=None,
+                                             tgt_mems=None, context_memory=None)
+        state = StreamDecodingState(src, None, context, None, beam_size=beam_size, model_size=8,
+                                    streaming_state=streaming_state)
+
+        # the decoder caches the mask on the state at the first step
+        state.src_pad_mask = state.src.transpose(0, 1).eq(onmt.constants.PAD).unsqueeze(1)
+
+        reorder_state = torch.tensor([5, 4, 3, 2, 1, 0])
+        state._reorder_incremental_state(reorder_state)
+
+        expected = state.src.transpose(0, 1).eq(onmt.constants.PAD).unsqueeze(1)
+        self.assertTrue(torch.equal(state.src_pad_mask, expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
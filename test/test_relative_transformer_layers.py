@@ -0,0 +1,167 @@
+import argparse
+import unittest
+
+import torch
+
+import onmt
+from onmt.modules.layer_norm import RMSNorm
+from onmt.models.relative_transformer_layers import RelativeTransformerEncoderLayer, \
+    RelativeTransformerDecoderLayer, LayerGraphCache
+
+
+def make_opt(**kwargs):
+
+    opt = argparse.Namespace()
+    opt.model_size = 16
+    opt.inner_size = 32
+    opt.n_heads = 4
+    opt.dropout = 0.0
+    opt.attn_dropout = 0.0
+    opt.variational_dropout = False
+    opt.ignore_source = False
+    opt.fast_self_attention = False
+    opt.fast_xattention = False
+    opt.fast_feed_forward = False
+    opt.fast_feed_forward_decoder = False
+    opt.rms_norm = False
+
+    for k, v in kwargs.items():
+        setattr(opt, k, v)
+
+    return opt
+
+
+class TestRelativeDecoderLayerCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        # normally set by the model factory
+        onmt.constants.weight_norm = False
+
+    def test_fast_feed_forward_loads_old_state_dict(self):
+        # before -fast_feed_forward_decoder existed, the decoder always built Bottle(FeedForward)
+        old_layer = RelativeTransformerDecoderLayer(make_opt())
+        old_state_dict = old_layer.state_dict()
+        self.assertIn('feedforward.function.fc_1.linear.weight', old_state_dict)
+
+        layer = RelativeTransformerDecoderLayer(make_opt(fast_feed_forward=True))
+        self.assertEqual(sorted(layer.state_dict().keys()), sorted(old_state_dict.keys()))
+
+        # strict loading fails on any renamed parameter instead of silently re-initialising it
+        layer.load_state_dict(old_state_dict, strict=True)
+
+        for k, v in layer.state_dict().items():
+            self.assertTrue(torch.equal(v, old_state_dict[k]), k)
+
+    def test_fast_feed_forward_decoder_uses_fused_ffn(self):
+
+        layer = RelativeTransformerDecoderLayer(make_opt(fast_feed_forward_decoder=True))
+        self.assertIn('feedforward.in_proj_weight', layer.state_dict())
+
+
+class TestRelativeLayerNorm(unittest.TestCase):
+
+    def setUp(self):
+        onmt.constants.weight_norm = False
+
+    def test_rms_norm(self):
+        for layer_class in [RelativeTransformerEncoderLayer, RelativeTransformerDecoderLayer]:
+            layer = layer_class(make_opt(rms_norm=True))
+            for name in ['preprocess_attn', 'preprocess_ffn']:
+                self.assertIsInstance(getattr(layer, name).layer_norm.function, RMSNorm, name)
+
+    def test_rms_norm_keeps_half_precision(self):
+        norm = RMSNorm(16)
+        output = norm(torch.randn(4, 16).half())
+        self.assertEqual(output.dtype, torch.float16)
+
+
+class TestRelativeEncoderLayerStack(unittest.TestCase):
+    """
+    The graphed / compiled layers against the eager layers, on small shapes without dropout
+    """
+
+    def setUp(self):
+        onmt.constants.weight_norm = False
+        self.len_q, self.bsz = 6, 3
+
+    def _build(self, device, n_layers=3):
+        torch.manual_seed(1234)
+        opt = make_opt()
+        layers = torch.nn.ModuleList([RelativeTransformerEncoderLayer(opt) for _ in range(n_layers)])
+        return layers.to(device).train(), opt
+
+    def _inputs(self, opt, device):
+        torch.manual_seed(4321)
+        context = torch.randn(self.len_q, self.bsz, opt.model_size, device=device)
+        pos_emb = torch.randn(2 * self.len_q - 1, 1, opt.model_size, device=device)
+        mask_src = torch.zeros(self.bsz, 1, self.len_q, dtype=torch.bool, device=device)
+        mask_src[0, :, -2:] = True
+        return context, pos_emb, mask_src
+
+    def _run(self, layers, callables, context, pos_emb, mask_src, input_grad=True):
+        layers.zero_grad()
+        x = context.clone().requires_grad_(input_grad)
+        out = x
+        for layer in callables:
+            out = layer(out, pos_emb, mask_src)
+        out.sum().backward()
+
+        grads = [x.grad.clone()] if input_grad else []
+        for name, p in layers.named_parameters():
+            self.assertIsNotNone(p.grad, name)
+            grads.append(p.grad.clone())
+        return out.detach(), grads
+
+    def _check(self, out, grads, ref_out, ref_grads):
+        self.assertTrue(torch.allclose(out, ref_out, atol=1e-5))
+        for g, ref_g in zip(grads, ref_grads):
+            self.assertTrue(torch.allclose(g, ref_g, atol=1e-5))
+
+    @unittest.skipUnless(torch.cuda.is_available(), "CUDA graphs need CUDA")
+    def test_cuda_graph_layers_match_eager(self):
+        device = torch.device('cuda')
+        layers, opt = self._build(device)
+        context, pos_emb, mask_src = self._inputs(opt, device)
+
+        ref_out, ref_grads = self._run(layers, layers, context, pos_emb, mask_src)
+
+        x = context.clone().requires_grad_()
+        graphed = LayerGraphCache(layers).get(x, pos_emb, mask_src)
+        self.assertIsNotNone(graphed)
+
+        # replay twice: the static inputs of the graphs must be refreshed at each call
+        for _ in range(2):
+            out, grads = self._run(layers, graphed, context, pos_emb, mask_src)
+            self._check(out, grads, ref_out, ref_grads)
+
+    @unittest.skipUnless(torch.cuda.is_available(), "CUDA graphs need CUDA")
+    def test_cuda_graph_layers_frozen_input(self):
+        # e.g. frozen embeddings: the gradients must still flow through every layer
+        device = torch.device('cuda')
+        layers, opt = self._build(device)
+        context, pos_emb, mask_src = self._inputs(opt, device)
+
+        ref_out, ref_grads = self._run(layers, layers, context, pos_emb, mask_src, input_grad=False)
+
+        graphed = LayerGraphCache(layers).get(context, pos_emb, mask_src)
+        self.assertIsNotNone(graphed)
+
+        out, grads = self._run(layers, graphed, context, pos_emb, mask_src, input_grad=False)
+        self._check(out, grads, ref_out, ref_grads)
+
+    @unittest.skipUnless(hasattr(torch, 'compile'), "torch.compile is not available")
+    def test_compiled_layers_match_eager(self):
+        device = torch.device('cpu')
+        layers, opt = self._build(device)
+        context, pos_emb, mask_src = self._inputs(opt, device)
+
+        ref_out, ref_grads = self._run(layers, layers, context, pos_emb, mask_src)
+
+        # the same wrappers as RelativeTransformerEncoder.get_compiled_layers
+        compiled = [torch.compile(layer, dynamic=True) for layer in layers]
+        out, grads = self._run(layers, compiled, context, pos_emb, mask_src)
+        self._check(out, grads, ref_out, ref_grads)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import argparse
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from onmt.models.multilingual_translator.reversible_transformers import reversible_encoder, \
+    ReversibleTransformerEncoderLayer, SourceAttention
+
+
+def make_opt(**kwargs):
+
+    opt = argparse.Namespace()
+    opt.model_size = 16
+    opt.inner_size = 32
+    opt.n_heads = 4
+    opt.dropout = 0.0
+    opt.attn_dropout = 0.0
+    opt.residual_dropout = 0.0
+    opt.ffn_dropout = 0.0
+    opt.variational_dropout = False
+    opt.ffn_glu = False
+    opt.ffn_activation = 'relu'
+    opt.learnable_position_encoding = False
+    opt.max_pos_length = 64
+    opt.ignore_source = False
+    opt.fused_ffn = False
+    opt.attn_bf16 = False
+    opt.sdpa_src_attention = False
+
+    for k, v in kwargs.items():
+        setattr(opt, k, v)
+
+    return opt
+
+
+class TestReversibleEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.len_q, self.bsz = 7, 3
+
+    def _build(self, opt, n_layers=2):
+        torch.manual_seed(1234)
+        layers = torch.nn.ModuleList([ReversibleTransformerEncoderLayer(opt) for _ in range(n_layers)])
+        return layers.double().to(self.device)
+
+    def _inputs(self, opt):
+        torch.manual_seed(4321)
+        x = torch.randn(self.len_q, self.bsz, opt.model_size, dtype=torch.float64, device=self.device)
+        pos = torch.randn(self.len_q, 1, opt.model_size, dtype=torch.float64, device=self.device)
+        return x, pos
+
+    def _grads(self, layers, x):
+        return [x.grad.clone()] + [p.grad.clone() for p in layers.parameters()]
+
+    def _check_against_autograd(self, opt):
+        layers = self._build(opt)
+        x, pos = self._inputs(opt)
+
+        # reversible: no-grad forward and recomputation in backward_pass
+        x_rev = x.clone().requires_grad_()
+        torch.manual_seed(42)
+        out_rev = reversible_encoder(layers, x_rev, pos, None)
+        out_rev.sum().backward()
+        rev_grads = self._grads(layers, x_rev)
+
+        # reference: the same layers with plain autograd, drawing the same dropout masks
+        layers.zero_grad()
+        x_ref = x.clone().requires_grad_()
+        torch.manual_seed(42)
+        x1, x2 = x_ref, x_ref
+        for layer in layers:
+            x1, x2 = layer(x1, x2, pos, None)
+        out_ref = 0.5 * (x1 + x2)
+        out_ref.sum().backward()
+        ref_grads = self._grads(layers, x_ref)
+
+        self.assertTrue(torch.allclose(out_rev, out_ref))
+        for g_rev, g_ref in zip(rev_grads, ref_grads):
+            self.assertTrue(torch.allclose(g_rev, g_ref))
+
+    def test_gradients_match_autograd(self):
+
+        self._check_against_autograd(make_opt(residual_dropout=0.1))
+
+    @unittest.skipUnless(hasattr(torch, 'compile'), "torch.compile is not available")
+    def test_fused_ffn_gradients_match_autograd(self):
+        # the residual dropout runs eagerly around the compiled feed-forward
+        self._check_against_autograd(make_opt(fused_ffn=True, residual_dropout=0.1))
+
+    def test_second_backward_fails(self):
+        opt = make_opt()
+        layers = self._build(opt)
+        x, pos = self._inputs(opt)
+        x.requires_grad_()
+
+        out = reversible_encoder(layers, x, pos, None)
+        out.sum().backward(retain_graph=True)
+
+        # the first backward restored the inputs in-place into the saved outputs
+        with self.assertRaises(RuntimeError):
+            out.sum().backward()
+
+
+@unittest.skipUnless(hasattr(F, 'scaled_dot_product_attention'), "F.scaled_dot_product_attention is not available")
+class TestSourceAttentionSDPA(unittest.TestCase):
+
+    def setUp(self):
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.len_q, self.len_k, self.bsz = 5, 7, 3
+
+    def _run(self, attn, input, context, attn_mask):
+        attn.zero_grad()
+        x = input.clone().requires_grad_()
+        c = context.clone().requires_grad_()
+        out, _ = attn(x, c, attn_mask=attn_mask)
+        out.sum().backward()
+        return out.detach(), [x.grad.clone(), c.grad.clone()] + [p.grad.clone() for p in attn.parameters()]
+
+    def test_sdpa_matches_encdec_attention(self):
+        opt = make_opt(sdpa_src_attention=True)
+        torch.manual_seed(1234)
+        attn = SourceAttention(opt).double().to(self.device)
+        self.assertTrue(attn.sdpa)
+
+        input = torch.randn(self.len_q, self.bsz, opt.model_size, dtype=torch.float64, device=self.device)
+        context = torch.randn(self.len_k, self.bsz, opt.model_size, dtype=torch.float64, device=self.device)
+        # bsz x 1 x len_k, True at the padded positions
+        attn_mask = torch.zeros(self.bsz, 1, self.len_k, dtype=torch.bool, device=self.device)
+        attn_mask[0, :, -3:] = True
+
+        out, grads = self._run(attn, input, context, attn_mask)
+
+        attn.sdpa = False
+        ref_out, ref_grads = self._run(attn, input, context, attn_mask)
+
+        self.assertTrue(torch.allclose(out, ref_out))
+        for g, ref_g in zip(grads, ref_grads):
+            self.assertTrue(torch.allclose(g, ref_g))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+import unittest
+
+import torch
+
+from onmt.models.transformer_layers import PositionalEncoding
+
+
+class TestPositionalEncoding(unittest.TestCase):
+
+    def test_load_state_dict_does_not_touch_other_instances(self):
+        reference = PositionalEncoding(16, len_max=32).pos_emb.clone()
+
+        pe = PositionalEncoding(16, len_max=32)
+        # e.g. a checkpoint saved in half precision
+        pe.load_state_dict({'pos_emb': reference.half().float() + 1.0})
+
+        self.assertTrue(torch.equal(PositionalEncoding(16, len_max=32).pos_emb, reference))
+
+
+if __name__ == '__main__':
+    unittest.main()